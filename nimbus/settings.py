@@ -150,3 +150,78 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 LOGIN_REDIRECT_URL = '/' # Redirects to home after login
 LOGOUT_REDIRECT_URL = '/' # Redirects to home after logout
+
+# Memory budget for the in-process cache of intermediate preview results
+REPORTS_PREVIEW_CACHE_BYTES = int(os.getenv('REPORTS_PREVIEW_CACHE_BYTES', 256 * 1024 * 1024))
+
+# Number of CSV rows read at a time when a report is streamed
+REPORTS_CHUNK_ROWS = int(os.getenv('REPORTS_CHUNK_ROWS', 50000))
+
+# Generated report CSVs, reused by repeat downloads until the store exceeds its size cap
+REPORTS_ARTIFACT_DIR = os.getenv('REPORTS_ARTIFACT_DIR', BASE_DIR / 'report_artifacts')
+REPORTS_ARTIFACT_MAX_BYTES = int(os.getenv('REPORTS_ARTIFACT_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Intermediate results of report runs, so an edited report only recomputes from its first changed widget.
+# Set REPORTS_CHECKPOINT_MAX_BYTES to 0 to disable checkpointing.
+REPORTS_CHECKPOINT_DIR = os.getenv('REPORTS_CHECKPOINT_DIR', BASE_DIR / 'report_checkpoints')
+REPORTS_CHECKPOINT_MAX_BYTES = int(os.getenv('REPORTS_CHECKPOINT_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Results of incremental reports, which only process the rows appended to their CSV since the last run
+REPORTS_APPEND_DIR = os.getenv('REPORTS_APPEND_DIR', BASE_DIR / 'report_appends')
+
+# Uploaded CSVs, stored once per distinct content under their SHA-256
+REPORTS_UPLOAD_DIR = os.getenv('REPORTS_UPLOAD_DIR', BASE_DIR / 'uploads')
+
+# CSV uploads are hashed and profiled (rows, delimiter, encoding and the first REPORTS_UPLOAD_PREVIEW_ROWS rows)
+# while they are received, see reports/uploads.py
+REPORTS_UPLOAD_PREVIEW_ROWS = int(os.getenv('REPORTS_UPLOAD_PREVIEW_ROWS', 5))
+FILE_UPLOAD_HANDLERS = [
+    'reports.uploads.CSVUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Where report generation jobs run: 'thread' (in-process pool), 'orm' (manage.py run_report_worker) or 'sync'
+REPORTS_JOB_BACKEND = os.getenv('REPORTS_JOB_BACKEND', 'thread')
+REPORTS_JOB_WORKERS = int(os.getenv('REPORTS_JOB_WORKERS', 2))
+# Running jobs refresh a heartbeat every REPORTS_JOB_HEARTBEAT_SECONDS. One without a heartbeat for
+# REPORTS_JOB_STALE_SECONDS lost its process and is queued again, up to REPORTS_JOB_MAX_ATTEMPTS runs in all.
+REPORTS_JOB_HEARTBEAT_SECONDS = float(os.getenv('REPORTS_JOB_HEARTBEAT_SECONDS', 10))
+REPORTS_JOB_STALE_SECONDS = float(os.getenv('REPORTS_JOB_STALE_SECONDS', 60))
+REPORTS_JOB_MAX_ATTEMPTS = int(os.getenv('REPORTS_JOB_MAX_ATTEMPTS', 2))
+
+# Serve previews, downloads and regeneration with the async views of reports/async_views.py (ASGI deployments),
+# which run the pandas work in a pool of REPORTS_ASYNC_WORKERS threads
+REPORTS_ASYNC_VIEWS = os.getenv('REPORTS_ASYNC_VIEWS', 'False') == 'True'
+REPORTS_ASYNC_WORKERS = int(os.getenv('REPORTS_ASYNC_WORKERS', os.cpu_count() or 1))
+
+# Widget code generation. WIDGET_CODEGEN_BACKEND is 'transformers' or 'stub' (offline, returns a no-op widget);
+# a small model such as 'sshleifer/tiny-gpt2' can stand in for GPT-Neo when benchmarking.
+WIDGET_CODEGEN_BACKEND = os.getenv('WIDGET_CODEGEN_BACKEND', 'transformers')
+WIDGET_CODEGEN_MODEL = os.getenv('WIDGET_CODEGEN_MODEL', 'EleutherAI/gpt-neo-1.3B')
+WIDGET_CODEGEN_WARMUP = os.getenv('WIDGET_CODEGEN_WARMUP', 'False') == 'True'  # Load the model at worker start
+WIDGET_CODEGEN_BATCH_SIZE = int(os.getenv('WIDGET_CODEGEN_BATCH_SIZE', 8))
+WIDGET_CODEGEN_BATCH_WAIT = float(os.getenv('WIDGET_CODEGEN_BATCH_WAIT', 0.05))  # Seconds to wait for more prompts
+
+# Worker processes that run user widget code (0 runs it in the web process instead) and their limits
+REPORTS_SANDBOX_WORKERS = int(os.getenv('REPORTS_SANDBOX_WORKERS', os.cpu_count() or 1))
+REPORTS_SANDBOX_CPU_SECONDS = int(os.getenv('REPORTS_SANDBOX_CPU_SECONDS', 30))
+REPORTS_SANDBOX_WALL_SECONDS = float(os.getenv('REPORTS_SANDBOX_WALL_SECONDS', 60))
+REPORTS_SANDBOX_MEMORY_BYTES = int(os.getenv('REPORTS_SANDBOX_MEMORY_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Pipeline logging is quiet unless REPORTS_LOG_LEVEL is lowered (e.g. to DEBUG for per-widget timings)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'reports': {
+            'handlers': ['console'],
+            'level': os.getenv('REPORTS_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
@@ -1,8 +1,133 @@
-from transformers import pipeline
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
-def generate_widget_from_text(user_input):
-    generator = pipeline('text-generation', model='EleutherAI/gpt-neo-1.3B')
+from django.conf import settings
+
+
+STUB_CODE = """
+def transform(df):
+    return df
+"""
+
+
+class StubGenerator:
+    """
+    Offline stand-in for the transformers text-generation pipeline.
+
+    It takes the same arguments and returns results in the same shape, echoing
+    the prompt followed by a no-op widget, so code generation can be tested
+    and benchmarked without downloading a model.
+    """
+
+    def __call__(self, prompts, max_length=200, num_return_sequences=1, **kwargs):
+        single = isinstance(prompts, str)
+        results = [
+            [{'generated_text': prompt + "\n" + STUB_CODE} for _ in range(num_return_sequences)]
+            for prompt in ([prompts] if single else prompts)
+        ]
+        return results[0] if single else results
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def _load_generator():
+    if settings.WIDGET_CODEGEN_BACKEND == 'stub':
+        return StubGenerator()
+
+    # Imported here so processes that never generate code don't pay for it
+    from transformers import pipeline
+    generator = pipeline('text-generation', model=settings.WIDGET_CODEGEN_MODEL)
+    # Batched generation pads prompts, GPT-style models ship without a pad token
+    if generator.tokenizer.pad_token_id is None:
+        generator.tokenizer.pad_token_id = generator.model.config.eos_token_id
+    generator.tokenizer.padding_side = 'left'
+    return generator
+
+
+def get_generator():
+    """Return the process-wide text-generation model, loading it on first use."""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = _load_generator()
+    return _generator
 
+
+def warm_up_generator():
+    """Load the model in a background thread so the first request doesn't wait for it."""
+    thread = threading.Thread(target=get_generator, name='codegen-warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+class GenerationBatcher:
+    """
+    Collects prompts submitted concurrently and runs them through the model
+    as a single batch. A batch is closed once it holds `max_batch_size`
+    prompts or `max_wait` seconds after its first prompt arrived.
+    """
+
+    def __init__(self, max_batch_size=8, max_wait=0.05, max_length=200):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_length = max_length
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def generate(self, prompt):
+        future = Future()
+        self._queue.put((prompt, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='codegen-batcher', daemon=True)
+                self._worker.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            prompts = [prompt for prompt, _ in batch]
+            try:
+                responses = get_generator()(
+                    prompts, max_length=self.max_length, num_return_sequences=1, batch_size=len(prompts)
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response[0]['generated_text'])
+
+
+batcher = GenerationBatcher(
+    max_batch_size=settings.WIDGET_CODEGEN_BATCH_SIZE,
+    max_wait=settings.WIDGET_CODEGEN_BATCH_WAIT,
+)
+
+
+def generate_widget_from_text(user_input):
     # General-purpose prompt based on the user input
     prompt = (
         f"Write a Python function to accomplish the following task: {user_input}. "
@@ -10,11 +135,8 @@ def generate_widget_from_text(user_input):
         "must modify it in place. Avoid unnecessary imports or unrelated code."
     )
 
-    # Generate code using GPT-Neo
-    response = generator(prompt, max_length=200, num_return_sequences=1)
-    
-    # Post-process: Remove extra imports, restrict to function definitions
-    code = response[0]['generated_text']
-    
+    # Generate code with the shared model, batched with any concurrent requests
+    code = batcher.generate(prompt)
+
     # Additional logic to ensure valid code can be added here
     return code
@@ -0,0 +1,290 @@
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+
+from .schema import apply_schema, fits_schema, infer_schema
+
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+BLOCK_SIZE = 1024 * 1024
+
+
+class _AppendedRows(io.RawIOBase):
+    """The header line followed by the bytes of `f` up to `end`, hashed into `digest` as they are read."""
+
+    def __init__(self, f, header, end, digest):
+        self.f = f
+        self.pending = header
+        self.remaining = end - f.tell()
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.pending:
+            data, self.pending = self.pending[:len(buffer)], self.pending[len(buffer):]
+        else:
+            data = self.f.read(min(len(buffer), self.remaining))
+            self.remaining -= len(data)
+            self.digest.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _last_line_end(f, start, size):
+    # Offset just past the last newline in [start, size), or start when there is none
+    position = size
+    while position > start:
+        block_start = max(start, position - BLOCK_SIZE)
+        f.seek(block_start)
+        newline = f.read(position - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        position = block_start
+    return start
+
+
+def _hash_prefix(f, end):
+    digest = hashlib.sha256()
+    f.seek(0)
+    remaining = end
+    while remaining:
+        block = f.read(min(BLOCK_SIZE, remaining))
+        if not block:
+            break
+        digest.update(block)
+        remaining -= len(block)
+    return digest
+
+
+def plan_key(plan):
+    return hashlib.sha256(json.dumps(plan.signatures(), default=str).encode()).hexdigest()[:32]
+
+
+class AppendStore:
+    """
+    Results of incremental reports, for CSVs that only ever grow by rows
+    appended at the end.
+
+    For each report and plan it keeps the transformed output so far and a state: the
+    byte offset and row count of the input processed, the SHA-256 of the
+    input up to that offset, the plan signatures and the per-step state of
+    the plan, e.g. the keys a Row Deduplicator kept. A refresh checks that
+    the processed prefix still hashes the same, runs only the rows after it
+    through the plan and appends the output. A changed prefix starts over
+    from the first byte, a changed plan gets a state of its own; only the
+    `keep_plans` most recently refreshed plans of a report are kept.
+
+    The last line is left for the next refresh until it ends with a newline,
+    so a feed that is being written to is never read mid-row. The dtypes
+    inferred from the first rows are kept for the later ones; when appended
+    rows don't fit them, e.g. a number too large for the integer type chosen,
+    the whole file is processed again with a schema inferred from all of it.
+    """
+
+    def __init__(self, root, keep_plans=2):
+        self.root = str(root)
+        self.keep_plans = keep_plans
+
+    def directory(self, report_id):
+        return os.path.join(self.root, str(report_id))
+
+    def plan_directory(self, report_id, plan):
+        # One state per plan, so runs that order the same widgets differently don't reset each other
+        return os.path.join(self.directory(report_id), plan_key(plan))
+
+    @contextmanager
+    def _lock(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load_state(self, directory):
+        try:
+            with open(os.path.join(directory, 'state.json')) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return state if state.get('version') == STATE_VERSION else None
+
+    def _save_state(self, directory, state):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, os.path.join(directory, 'state.json'))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _step_state_path(self, directory, index, generation):
+        # Versioned, so the files of the previous state stay valid until the new state is written
+        return os.path.join(directory, f'step-{index}.{generation}.npy')
+
+    def _load_step_states(self, directory, state):
+        return [
+            np.load(self._step_state_path(directory, index, state['generation'])) if present else None
+            for index, present in enumerate(state['step_states'])
+        ]
+
+    def _save_step_states(self, directory, states, generation):
+        for index, step_state in enumerate(states):
+            if step_state is not None:
+                np.save(self._step_state_path(directory, index, generation), step_state)
+        return [step_state is not None for step_state in states]
+
+    def _continues(self, state, plan, f, size):
+        # The digest of the processed prefix when `f` still starts with it, otherwise None
+        if state is None or state['signatures'] != json.loads(json.dumps(plan.signatures(), default=str)):
+            return None
+        if size < state['offset']:
+            return None
+        digest = _hash_prefix(f, state['offset'])
+        return digest if digest.hexdigest() == state['prefix_sha256'] else None
+
+    def refresh(self, report_id, plan, csv_file_path, on_step=None, stats=None):
+        """
+        Bring the stored result of `report_id` up to date with `csv_file_path`
+        and return its state, or None while the file has no complete line yet.
+        """
+        directory = self.plan_directory(report_id, plan)
+        with self._lock(directory), open(csv_file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            previous = state = self.load_state(directory)
+            digest = self._continues(state, plan, f, size)
+            if digest is None:
+                if state is not None:
+                    logger.info("Input of incremental report %s changed, processing it from the start", report_id)
+                state, digest = None, hashlib.sha256()
+                offset, header, step_states = 0, b'', [None] * len(plan)
+            else:
+                offset, header = state['offset'], state['header'].encode()
+                step_states = self._load_step_states(directory, state)
+
+            end = _last_line_end(f, offset, size)
+            if end == offset:
+                if state is not None:
+                    os.utime(os.path.join(directory, 'state.json'))  # Mark as recently refreshed
+                return state
+            if state is None:
+                f.seek(0)
+                header = f.readline()
+
+            df = self._read_rows(f, header, offset, end, digest)
+            schema = state['schema'] if state is not None else infer_schema(df)
+            df = apply_schema(df, schema)
+            if state is not None and not fits_schema(df, schema):
+                # The stored result and step states were computed with dtypes that can't hold the new
+                # rows, and casting would change them: start over with a schema for the whole file
+                logger.info("Appended rows of incremental report %s don't fit its schema, processing it from the start", report_id)
+                state, digest = None, hashlib.sha256()
+                step_states = [None] * len(plan)
+                df = self._read_rows(f, header, 0, end, digest)
+                schema = infer_schema(df)
+                df = apply_schema(df, schema)
+            logger.debug("Processing %s appended row(s) of incremental report %s", len(df), report_id)
+
+            result, step_states = plan.run_appended(df, step_states, on_step=on_step, stats=stats)
+            result_bytes = self._append_result(directory, state, result)
+
+            generation = previous['generation'] + 1 if previous is not None else 0
+            new_state = {
+                'version': STATE_VERSION,
+                'signatures': json.loads(json.dumps(plan.signatures(), default=str)),
+                'offset': end,
+                'rows': (state['rows'] if state is not None else 0) + len(df),
+                'prefix_sha256': digest.hexdigest(),
+                'header': header.decode(),
+                'schema': schema,
+                'result_bytes': result_bytes,
+                'result_rows': (state['result_rows'] if state is not None else 0) + len(result),
+                'generation': generation,
+                'step_states': self._save_step_states(directory, step_states, generation),
+            }
+            self._save_state(directory, new_state)
+            if previous is not None:
+                for index, present in enumerate(previous['step_states']):
+                    if present:
+                        os.unlink(self._step_state_path(directory, index, previous['generation']))
+        self._prune(report_id)
+        return new_state
+
+    def _read_rows(self, f, header, start, end, digest):
+        # Parse the rows between `start` and `end`, hashing them into `digest`
+        f.seek(start)
+        rows = _AppendedRows(f, header if start else b'', end, digest)
+        df = pd.read_csv(io.BufferedReader(rows))
+        while rows.remaining:  # Hash anything the parser didn't need, e.g. trailing blank lines
+            rows.readinto(bytearray(BLOCK_SIZE))
+        df.columns = df.columns.str.lower()
+        return df
+
+    def _append_result(self, directory, state, result):
+        path = os.path.join(directory, 'result.csv')
+        if state is None:
+            # Start over in a new file, so readers of the old one keep a consistent copy
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(result.to_csv(index=False).encode())
+            os.replace(tmp_path, path)
+            return os.path.getsize(path)
+
+        with open(path, 'r+b') as f:
+            # Drop whatever an interrupted refresh appended past the stored result
+            f.truncate(state['result_bytes'])
+            f.seek(state['result_bytes'])
+            f.write(result.to_csv(index=False, header=False).encode())
+            return f.tell()
+
+    def read(self, report_id, plan, state, block_size=64 * 1024):
+        """Yield the stored result of `plan` as of `state`, as returned by refresh(), or return None."""
+        try:
+            f = open(os.path.join(self.plan_directory(report_id, plan), 'result.csv'), 'rb')
+        except FileNotFoundError:
+            return None
+        return self._iter_result(f, state['result_bytes'], block_size)
+
+    def _iter_result(self, f, size, block_size):
+        with f:
+            while size > 0:
+                block = f.read(min(block_size, size))
+                if not block:
+                    break
+                size -= len(block)
+                yield block
+
+    def _prune(self, report_id):
+        # Drop the states of the plans the report has been refreshed with least recently
+        def last_refreshed(directory):
+            try:
+                return os.path.getmtime(os.path.join(directory, 'state.json'))
+            except FileNotFoundError:
+                return 0
+        directories = [entry.path for entry in os.scandir(self.directory(report_id)) if entry.is_dir()]
+        for directory in sorted(directories, key=last_refreshed, reverse=True)[self.keep_plans:]:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def discard(self, report_id):
+        shutil.rmtree(self.directory(report_id), ignore_errors=True)
+
+
+append_store = AppendStore(settings.REPORTS_APPEND_DIR)
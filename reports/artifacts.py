@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+
+class ArtifactStore:
+    """
+    On-disk store of generated report CSVs.
+
+    Artifacts are keyed by a fingerprint of the CSV content and the ordered
+    plan signatures, so a key never has to be invalidated: any change to the
+    input or the widgets produces a new key. A file's mtime is bumped on every
+    read and the least recently used artifacts are evicted once the store
+    grows beyond `max_bytes`.
+    """
+
+    suffix = '.csv'
+
+    def __init__(self, root, max_bytes, block_size=64 * 1024):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self._evict_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(fingerprint, signatures):
+        payload = json.dumps([fingerprint, [list(signature) for signature in signatures]], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + self.suffix)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def read(self, key):
+        """Yield the artifact's bytes, or return None when it is not stored."""
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # Mark as recently used
+        return self._iter_file(f)
+
+    def _iter_file(self, f):
+        with f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                yield block
+
+    def write_through(self, key, pieces):
+        """
+        Yield `pieces` unchanged while also writing them to the store.
+
+        The artifact only becomes visible once the stream was consumed in
+        full; an interrupted download leaves nothing behind.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for piece in pieces:
+                    f.write(piece)
+                    yield piece
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        with self._evict_lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+artifact_store = ArtifactStore(settings.REPORTS_ARTIFACT_DIR, settings.REPORTS_ARTIFACT_MAX_BYTES)
@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.shortcuts import aget_object_or_404
+
+from .jobs import enqueue_report_generation
+from .models import Report
+from .operators import compile_plan
+from .utils import get_ordered_widgets, preview_plan_page
+from .views import (
+    download_etag, job_status, not_modified, parse_preview_request, preview_response, report_download_content,
+    report_download_key, streaming_download,
+)
+
+
+# Async counterparts of the views that run the pipeline, for ASGI deployments
+# (REPORTS_ASYNC_VIEWS). The event loop only parses requests and awaits:
+#   - database access goes through the async ORM or sync_to_async
+#   - pandas work, hashing and report generation run in a pool of
+#     REPORTS_ASYNC_WORKERS threads, so a slow report holds one of those
+#     threads instead of the loop, and light requests keep being served
+#   - downloads are produced one piece at a time in the same pool
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_pipeline_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REPORTS_ASYNC_WORKERS, thread_name_prefix='report-pipeline'
+            )
+        return _executor
+
+
+def _call(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # Generation writes to the database from this thread, don't leave its connection behind
+        close_old_connections()
+
+
+async def run_in_pipeline(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pipeline_executor(), functools.partial(_call, function, *args))
+
+
+_done = object()
+
+
+async def iterate_in_pipeline(iterator):
+    # Advance a blocking iterator in the pipeline pool, one item at a time
+    iterator = iter(iterator)
+    while True:
+        item = await run_in_pipeline(next, iterator, _done)
+        if item is _done:
+            return
+        yield item
+
+
+async def report_plan(report):
+    widget_ids = [widget_id async for widget_id in report.widgets.values_list('id', flat=True)]
+    widgets = await sync_to_async(get_ordered_widgets)(widget_ids)
+    return compile_plan(widgets) if widgets else None
+
+
+async def preview_csv(request, report_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        widget_ids, options = parse_preview_request(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    report = await aget_object_or_404(Report, id=report_id)
+    if not report.csv_file:
+        return JsonResponse({'preview': {}})
+
+    plan = compile_plan(await sync_to_async(get_ordered_widgets)(widget_ids))
+    page = await run_in_pipeline(
+        preview_plan_page, plan, report.csv_file, options['limit'], options['offset'], options['sample']
+    )
+    # Encoding a large page is CPU work as well
+    return await run_in_pipeline(preview_response, page, options)
+
+
+async def download_csv_report(request, report_id):
+    report = await aget_object_or_404(Report, id=report_id)
+    plan = await report_plan(report)
+    if not report.csv_file or plan is None:
+        return HttpResponse("No data to export.", status=404)
+
+    key, state = await run_in_pipeline(report_download_key, report, plan)
+    if key is None:
+        return HttpResponse("No data to export.", status=404)
+
+    etag = download_etag(request, key)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    content, filename, content_type = await run_in_pipeline(report_download_content, request, report, plan, key, state)
+    return streaming_download(iterate_in_pipeline(content), filename, content_type, etag)
+
+
+async def regenerate_report(request, report_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    report = await aget_object_or_404(Report, id=report_id)
+    user = await request.auser()
+    widget_ids = [widget_id async for widget_id in report.widgets.values_list('id', flat=True)]
+
+    # With REPORTS_JOB_BACKEND = 'sync' the report is generated right here, off the event loop
+    job = await run_in_pipeline(enqueue_report_generation, report, user, widget_ids)
+    await job.arefresh_from_db()
+    return JsonResponse(job_status(job), status=202)
@@ -0,0 +1,236 @@
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.db import transaction
+
+from widgets.models import Widget
+from .artifacts import ArtifactStore
+from .cache import preview_cache
+from .catalog import widget_catalog
+from .encoders import encode_preview_response
+from .operators import OPERATORS, compile_plan
+from .utils import (
+    build_columnar_cache, generate_report_preview_page, gzip_stream, iter_csv_bytes,
+    iter_report_chunks, read_plan_input, read_report_csv,
+)
+
+
+# Synthetic CSVs follow the customers-100.csv schema plus a `Date` column.
+# Every value of a row is derived from its customer number, so a duplicate
+# row is an exact copy of an earlier one and a file is fully determined by
+# (rows, duplicate ratio, date range and distribution, seed).
+
+SCHEMA_COLUMNS = [
+    'Index', 'Customer Id', 'First Name', 'Last Name', 'Company', 'City', 'Country',
+    'Phone 1', 'Phone 2', 'Email', 'Subscription Date', 'Website',
+]
+DATE_DISTRIBUTIONS = ('uniform', 'recent')
+# Early enough for the Date Filter widget's fixed window to select some rows
+DEFAULT_START_DATE = date(2024, 1, 1)
+
+# Built-in widgets in the order a typical report applies them
+DEFAULT_CHAIN = ["Yesterday Trimmer", "Column Dropper", "Uppercase Name Converter", "Date Filter", "Row Deduplicator"]
+
+
+def _unit_hash(numbers, salt):
+    # Deterministic, well spread values in [0, 1) for each customer number
+    mixed = (numbers.astype(np.uint64) + np.uint64(salt)) * np.uint64(0x9E3779B97F4A7C15)
+    mixed ^= mixed >> np.uint64(29)
+    mixed *= np.uint64(0xBF58476D1CE4E5B9)
+    mixed ^= mixed >> np.uint64(32)
+    return (mixed >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def _pick(pool, numbers, salt):
+    pool = np.asarray(pool, dtype=object)
+    return pool[(_unit_hash(numbers, salt) * len(pool)).astype(np.int64)]
+
+
+def synthetic_dates(numbers, start, end, distribution='uniform', seed=0):
+    """Dates in [start, end] for each customer number, spread evenly or skewed towards `end`."""
+    u = _unit_hash(numbers, seed * 16 + 1)
+    if distribution == 'recent':
+        u = u ** 0.25
+    elif distribution != 'uniform':
+        raise ValueError(f"Unknown date distribution {distribution!r}, expected one of {DATE_DISTRIBUTIONS}.")
+    span = (end - start).days + 1
+    days = np.minimum((u * span).astype(np.int64), span - 1)
+    return np.datetime64(start, 'D') + days.astype('timedelta64[D]')
+
+
+def synthetic_frame(numbers, sample, start, end, distribution='uniform', seed=0):
+    """Build the rows for an array of customer numbers, drawing text values from `sample`."""
+    salt = seed * 16
+    data = {
+        'Index': numbers + 1,
+        'Customer Id': pd.Series(numbers * 7919 + 0x1000000000).map('{:015X}'.format).to_numpy(),
+    }
+    for offset, column in enumerate(SCHEMA_COLUMNS[2:], start=2):
+        data[column] = _pick(sample[column].dropna().unique(), numbers, salt + offset)
+    data['Date'] = np.datetime_as_string(synthetic_dates(numbers, start, end, distribution, seed))
+    return pd.DataFrame(data, columns=SCHEMA_COLUMNS + ['Date'])
+
+
+def write_synthetic_csv(path, rows, sample, duplicates=0.05, start=None, end=None,
+                        distribution='uniform', seed=0, chunk_rows=1_000_000):
+    """
+    Write a `rows` long CSV where a `duplicates` fraction of the rows repeats
+    an earlier customer. Rows are generated and written `chunk_rows` at a
+    time, so files far larger than memory can be produced.
+    """
+    end = end or date.today()
+    start = start or DEFAULT_START_DATE
+    rng = np.random.default_rng(seed)
+    unique = 0
+    with open(path, 'w', newline='') as f:
+        for chunk_start in range(0, rows, chunk_rows):
+            size = min(chunk_rows, rows - chunk_start)
+            is_duplicate = rng.random(size) < duplicates
+            if unique == 0 and size:
+                is_duplicate[0] = False
+            # New customers are numbered in order, duplicates pick any customer seen before them
+            numbers = unique + np.cumsum(~is_duplicate) - 1
+            seen = np.maximum(numbers, 1)
+            numbers[is_duplicate] = (rng.random(int(is_duplicate.sum())) * seen[is_duplicate]).astype(np.int64)
+            unique += int((~is_duplicate).sum())
+            synthetic_frame(numbers, sample, start, end, distribution, seed).to_csv(
+                f, index=False, header=chunk_start == 0
+            )
+    return path
+
+
+def _consume(pieces):
+    return sum(len(piece) for piece in pieces)
+
+
+class Benchmark:
+    """
+    Times the report pipeline on one synthetic CSV. Each measurement is
+    repeated `repeat` times and recorded as a dict with its raw timings.
+    Widgets are created in a transaction that is rolled back afterwards.
+    """
+
+    def __init__(self, csv_path, rows, repeat=3, chain=DEFAULT_CHAIN, preview_rows=100):
+        self.csv_path = csv_path
+        self.rows = rows
+        self.repeat = repeat
+        self.chain = list(chain)
+        self.preview_rows = preview_rows
+        self.results = []
+
+    def record(self, name, function, repeat=None, before=None):
+        # `before` runs ahead of every repetition without being timed, e.g. to clear a cache
+        timings = []
+        for _ in range(repeat or self.repeat):
+            if before is not None:
+                before()
+            started = time.perf_counter()
+            output = function()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        self.results.append({
+            'benchmark': name,
+            'rows': self.rows,
+            'seconds': timings,
+            'min': best,
+            'median': statistics.median(timings),
+            'rows_per_second': self.rows / best if best else None,
+            'output': output,
+        })
+
+    def run(self):
+        with transaction.atomic():
+            widgets = {name: Widget.objects.create(name=name) for name in OPERATORS}
+            try:
+                self._run(widgets)
+            finally:
+                transaction.set_rollback(True)
+                preview_cache.clear()
+                widget_catalog.clear()
+        return self.results
+
+    def preview(self, widget_ids, sample):
+        page = generate_report_preview_page(widget_ids, self.csv_path, self.preview_rows, 0, sample, seed=0)
+        return len(encode_preview_response(page['rows'], total_rows=page['total_rows']))
+
+    def download(self, plan, compress=False):
+        pieces = iter_csv_bytes(iter_report_chunks(plan, self.csv_path))
+        return _consume(gzip_stream(pieces) if compress else pieces)
+
+    def _run(self, widgets):
+        # One-off cost of a new upload: parse the CSV and write the columnar sidecar
+        self.record('ingest', lambda: len(build_columnar_cache(self.csv_path)), repeat=1)
+        self.record('read', lambda: len(read_report_csv(self.csv_path)))
+
+        # Widgets one at a time, on a frame that is already in memory
+        df = read_report_csv(self.csv_path)
+        for name, widget in widgets.items():
+            plan = compile_plan([widget])
+            self.record(f'widget:{name}', lambda plan=plan: len(plan.run(df)))
+        del df
+
+        # Full chains, including the read of the columns they need
+        chain = [widgets[name] for name in self.chain]
+        row_local = [widget for widget in chain if compile_plan([widget]).row_local]
+        plans = {'chain': compile_plan(chain), 'chain:row-local': compile_plan(row_local)}
+        for label, plan in plans.items():
+            self.record(label, lambda plan=plan: len(plan.run(read_plan_input(plan, self.csv_path))))
+
+        # Previews and downloads go through the same functions as the views
+        previews = {
+            'preview': ([widget.id for widget in chain], 'head'),
+            'preview:row-local': ([widget.id for widget in row_local], 'head'),
+            'preview:reservoir': ([widget.id for widget in row_local], 'reservoir'),
+        }
+        for label, (widget_ids, sample) in previews.items():
+            run = lambda widget_ids=widget_ids, sample=sample: self.preview(widget_ids, sample)
+            self.record(f'{label}:cold', run, before=preview_cache.clear)
+            self.record(f'{label}:warm', run)
+
+        for label, plan in plans.items():
+            label = label.replace('chain', 'download')
+            self.record(label, lambda plan=plan: self.download(plan))
+            self.record(f'{label}:gzip', lambda plan=plan: self.download(plan, compress=True))
+
+        with tempfile.TemporaryDirectory() as root:
+            store = ArtifactStore(root, max_bytes=2 ** 62)
+            key = store.make_key('benchmark', plans['chain'].signatures())
+            _consume(store.write_through(key, iter_csv_bytes(iter_report_chunks(plans['chain'], self.csv_path))))
+            self.record('download:artifact', lambda: _consume(store.read(key)))
+
+
+def environment():
+    """Versions and machine details stored with every result file."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare_results(current, baseline):
+    """Yield (rows, benchmark, baseline min, current min, ratio) for benchmarks present in both runs."""
+    previous = {(result['rows'], result['benchmark']): result['min'] for result in baseline['results']}
+    for result in current['results']:
+        before = previous.get((result['rows'], result['benchmark']))
+        if before:
+            yield result['rows'], result['benchmark'], before, result['min'], result['min'] / before
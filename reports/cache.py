@@ -0,0 +1,120 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def file_fingerprint(path, block_size=1024 * 1024):
+    """
+    Return the SHA-256 of a file's content.
+
+    The digest is memoized by (path, size, mtime) so repeated requests for an
+    unchanged upload don't hash the whole file again.
+    """
+    stat = os.stat(path)
+    stat_key = (stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    fingerprint = digest.hexdigest()
+
+    remember_fingerprint(path, fingerprint, stat)
+    return fingerprint
+
+
+def remember_fingerprint(path, fingerprint, stat=None):
+    # Record a digest computed elsewhere, e.g. while the upload was being written
+    stat = stat or os.stat(path)
+    with _fingerprints_lock:
+        _fingerprints[path] = ((stat.st_size, stat.st_mtime_ns), fingerprint)
+
+
+def frame_nbytes(df, sample_size=1000):
+    # Shallow sizes, plus for text columns the average size of a sample of their values times the
+    # number of rows, so accounting for a cached frame doesn't visit every string. The sample is
+    # drawn at random (with a fixed seed) rather than evenly spaced, which misses periodic data.
+    nbytes = int(df.memory_usage(index=True, deep=False).sum())
+    if not len(df):
+        return nbytes
+    positions = np.random.default_rng(0).integers(0, len(df), min(sample_size, len(df)))
+    for column, dtype in df.dtypes.items():
+        if dtype == object:
+            sample = df[column].iloc[positions]
+            per_value = (sample.memory_usage(index=False, deep=True) - sample.memory_usage(index=False)) / len(sample)
+            nbytes += int(per_value * len(df))
+    return nbytes
+
+
+class PrefixCache:
+    """
+    In-process LRU cache of intermediate pipeline results.
+
+    Entries are keyed by (CSV fingerprint, signatures of the steps applied so
+    far) and evicted least recently used first once their combined size goes
+    over `max_bytes`. Cached DataFrames are shared with callers and must be
+    treated as read-only.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(fingerprint, signatures):
+        return (fingerprint, tuple(signatures))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, df):
+        nbytes = frame_nbytes(df)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (df, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def longest_prefix(self, fingerprint, signatures):
+        """Return (n, df) for the longest cached prefix of `signatures`, or (0, None)."""
+        for n in range(len(signatures), -1, -1):
+            df = self.get(self.make_key(fingerprint, signatures[:n]))
+            if df is not None:
+                return n, df
+        return 0, None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+preview_cache = PrefixCache(getattr(settings, 'REPORTS_PREVIEW_CACHE_BYTES', 256 * 1024 * 1024))
@@ -0,0 +1,71 @@
+import threading
+
+from django.core.cache import cache
+
+from widgets.models import Widget
+
+
+# Bumped in the shared cache whenever a widget changes, so processes other than
+# the one that saved it drop their copies too. With the default per-process
+# cache backend only the signals of the local process apply.
+VERSION_KEY = 'reports:widget-catalog-version'
+
+
+class WidgetCatalog:
+    """
+    Per-process cache of Widget rows by id.
+
+    Missing widgets are loaded with one bulk query per lookup. Entries are
+    dropped by the Widget post_save/post_delete signals (see signals.py);
+    changes made with QuerySet.update() or raw SQL bypass them, so call
+    invalidate() after those. Cached widgets are shared between threads and must
+    not be modified.
+    """
+
+    def __init__(self):
+        self._widgets = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        version = cache.get(VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                self._widgets.clear()
+                self._version = version
+
+    def get_many(self, widget_ids):
+        """Return {id: widget} for the ids that exist."""
+        self._check_version()
+        with self._lock:
+            found = {widget_id: self._widgets[widget_id] for widget_id in widget_ids if widget_id in self._widgets}
+        missing = {widget_id for widget_id in widget_ids if widget_id not in found}
+        if missing:
+            loaded = Widget.objects.in_bulk(missing)
+            with self._lock:
+                self._widgets.update(loaded)
+            found.update(loaded)
+        return found
+
+    def ordered(self, widget_ids):
+        """Return the widgets in the order of `widget_ids`, raising Widget.DoesNotExist for unknown ids."""
+        widgets = self.get_many(widget_ids)
+        try:
+            return [widgets[widget_id] for widget_id in widget_ids]
+        except KeyError as e:
+            raise Widget.DoesNotExist(f"Widget matching id {e.args[0]} does not exist.")
+
+    def clear(self):
+        with self._lock:
+            self._widgets.clear()
+
+    def invalidate(self):
+        """Drop the cached widgets of this and, through the shared cache, every other process."""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+        self.clear()
+
+
+widget_catalog = WidgetCatalog()
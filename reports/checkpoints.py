@@ -0,0 +1,67 @@
+import logging
+import os
+import tempfile
+
+import pandas as pd
+
+from django.conf import settings
+
+from .artifacts import ArtifactStore
+
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore(ArtifactStore):
+    """
+    On-disk store of the intermediate results of report runs.
+
+    A checkpoint is the DataFrame a plan produced after its first n steps,
+    keyed like an artifact by the input and the signatures of those n steps.
+    Changing the CSV or the widget at position n changes the key of every
+    checkpoint from n on, so a run resumes after the longest unchanged
+    prefix of its widget list and stale checkpoints are only ever evicted.
+    """
+
+    suffix = '.pkl'
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            df = pd.read_pickle(path)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # E.g. written by a pandas version that can no longer read it
+            logger.warning("Ignoring unreadable checkpoint %s: %s", path, e)
+            return None
+        return df
+
+    def save(self, key, df):
+        if not self.max_bytes:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_pickle(tmp_path, protocol=5)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def longest_prefix(self, base, signatures):
+        """Return (n, df) for the longest checkpointed prefix of `signatures`, or (0, None)."""
+        if not self.max_bytes:
+            return 0, None
+        for n in range(len(signatures), 0, -1):
+            df = self.load(self.make_key(base, signatures[:n]))
+            if df is not None:
+                return n, df
+        return 0, None
+
+
+checkpoint_store = CheckpointStore(settings.REPORTS_CHECKPOINT_DIR, settings.REPORTS_CHECKPOINT_MAX_BYTES)
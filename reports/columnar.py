@@ -0,0 +1,255 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .cache import file_fingerprint
+from .dates import DateIndex, parse_dates
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Parsed copies of uploaded CSVs, stored next to the upload as one .npy file per
+# column so reads can memory-map them and only touch the columns they need.
+SIDECAR_SUFFIX = '.columns'
+FORMAT_VERSION = 3
+
+
+def sidecar_path(csv_file_path):
+    return str(csv_file_path) + SIDECAR_SUFFIX
+
+
+def _column_files(directory, index):
+    return os.path.join(directory, f'{index}.npy'), os.path.join(directory, f'{index}.values.npy')
+
+
+def _text_files(directory, index):
+    # Distinct strings of a text column as UTF-8 bytes, and where each one ends in them
+    return os.path.join(directory, f'{index}.text.npy'), os.path.join(directory, f'{index}.ends.npy')
+
+
+def _date_files(directory, index):
+    # Parsed values, row positions in date order and the values in that order
+    return tuple(os.path.join(directory, f'{index}.dates.{name}.npy') for name in ('parsed', 'order', 'sorted'))
+
+
+def _save_array(path, values):
+    # Written next to the target and renamed, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _text_dtype(dtype):
+    # How a dictionary encoded column is turned back into a column on read
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    if isinstance(dtype, pd.StringDtype):
+        return f'string[{dtype.storage}]'
+    if dtype == object:
+        return 'object'
+    return None
+
+
+def write_sidecar(csv_file_path, df, date_formats=None):
+    """
+    Store `df`, the parsed content of `csv_file_path`, as a columnar sidecar.
+
+    Numeric, boolean and datetime columns are saved as-is. Text columns
+    (object, category and string dtypes) are dictionary encoded into integer
+    codes plus their distinct values, stored as UTF-8 bytes and offsets when
+    they are all strings, so they can be memory-mapped as well. They are read
+    back with the dtype they were written with.
+    `date_formats` maps date columns to their format for when they get parsed.
+    """
+    directory = sidecar_path(csv_file_path)
+    tmp_directory = tempfile.mkdtemp(dir=os.path.dirname(directory) or '.', suffix='.tmp')
+    try:
+        kinds, dtypes = [], []
+        for index, column in enumerate(df.columns):
+            values_file, uniques_file = _column_files(tmp_directory, index)
+            text_file, ends_file = _text_files(tmp_directory, index)
+            series = df[column]
+            dtype = _text_dtype(series.dtype)
+            if dtype is None:
+                np.save(values_file, series.to_numpy())
+                kinds.append('values')
+                dtypes.append(str(series.dtype))
+                continue
+
+            if dtype == 'category':
+                codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                codes, uniques = pd.factorize(series, use_na_sentinel=True)
+            uniques = np.asarray(uniques, dtype=object)
+            if all(isinstance(value, str) for value in uniques):
+                encoded = [value.encode('utf-8', 'surrogatepass') for value in uniques]
+                np.save(ends_file, np.cumsum([len(value) for value in encoded], dtype=np.int64))
+                np.save(text_file, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+                kinds.append('strings')
+            else:
+                np.save(uniques_file, uniques, allow_pickle=True)
+                kinds.append('objects')
+            np.save(values_file, codes.astype(np.int32))
+            dtypes.append(dtype)
+
+        meta = {
+            'version': FORMAT_VERSION,
+            'fingerprint': file_fingerprint(csv_file_path),
+            'columns': list(df.columns),
+            'kinds': kinds,
+            'dtypes': dtypes,
+            'date_formats': date_formats or {},
+            'rows': len(df),
+        }
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_directory, directory)
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+
+class ColumnarFile:
+    """A memory-mapped sidecar. Columns are only read when they are accessed."""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.columns = meta['columns']
+        self.kinds = dict(zip(self.columns, meta['kinds']))
+        self.dtypes = dict(zip(self.columns, meta['dtypes']))
+        self.date_formats = meta['date_formats']
+        self.rows = meta['rows']
+        self._index = {column: index for index, column in enumerate(self.columns)}
+        self._dictionaries = {}
+        self._categories = {}
+
+    def _dictionary(self, column):
+        # Loaded once per file: pickled values, or memory-mapped (ends, text) for strings
+        if column not in self._dictionaries:
+            index = self._index[column]
+            if self.kinds[column] == 'strings':
+                text_file, ends_file = _text_files(self.directory, index)
+                text = memoryview(np.load(text_file, mmap_mode='r'))
+                self._dictionaries[column] = (np.load(ends_file, mmap_mode='r'), text)
+            else:
+                self._dictionaries[column] = np.load(_column_files(self.directory, index)[1], allow_pickle=True)
+        return self._dictionaries[column]
+
+    def _uniques(self, column, codes):
+        # The distinct values with these codes, NaN for the missing value code -1
+        found = codes >= 0
+        uniques = np.full(len(codes), np.nan, dtype=object)
+        dictionary = self._dictionary(column)
+        if self.kinds[column] == 'objects':
+            uniques[found] = dictionary[codes[found]]
+            return uniques
+
+        ends, text = dictionary
+        codes = codes[found]
+        stops = ends[codes]
+        starts = np.where(codes > 0, ends[codes - 1], 0)
+        strings = np.empty(len(codes), dtype=object)
+        strings[:] = [str(text[start:stop], 'utf-8', 'surrogatepass') for start, stop in zip(starts.tolist(), stops.tolist())]
+        uniques[found] = strings
+        return uniques
+
+    def _decode(self, column, rows):
+        values_file = _column_files(self.directory, self._index[column])[0]
+        values = np.array(np.load(values_file, mmap_mode='r')[rows])
+        kind = self.kinds[column]
+        if kind == 'values':
+            return values
+
+        dtype = self.dtypes[column]
+        if dtype == 'category':
+            # Every chunk gets all the categories, so they concatenate into one categorical
+            if column not in self._categories:
+                dictionary = self._dictionary(column)
+                size = len(dictionary[0]) if kind == 'strings' else len(dictionary)
+                self._categories[column] = self._uniques(column, np.arange(size))
+            return pd.Categorical.from_codes(values, categories=self._categories[column], validate=False)
+
+        # Only the distinct values that appear in these rows are decoded
+        codes, inverse = np.unique(values, return_inverse=True)
+        uniques = self._uniques(column, codes)
+        if dtype == 'string[pyarrow]' and pyarrow is not None:
+            dictionary = pyarrow.array(uniques, type=pyarrow.string(), from_pandas=True)
+            decoded = pyarrow.DictionaryArray.from_arrays(pyarrow.array(inverse.astype(np.int32)), dictionary)
+            return pd.arrays.ArrowStringArray(decoded.dictionary_decode())
+
+        decoded = uniques.take(inverse.reshape(-1))
+        # Arrow strings stay object columns when pyarrow isn't installed
+        return pd.array(decoded, dtype=dtype) if dtype == 'string[python]' else decoded
+
+    def read(self, columns=None, start=0, stop=None, rows=None, dates=()):
+        """
+        Read rows [start, stop), or the row positions in `rows`, of `columns`.
+        Columns in `dates` are returned parsed as datetime64[ns].
+        """
+        columns = self.columns if columns is None else [column for column in self.columns if column in columns]
+        if rows is None:
+            stop = self.rows if stop is None else min(stop, self.rows)
+            rows, index = slice(start, stop), pd.RangeIndex(start, max(start, stop))
+        else:
+            index = pd.Index(rows)
+        data = {
+            column: self.read_dates(column, rows) if column in dates else self._decode(column, rows)
+            for column in columns
+        }
+        return pd.DataFrame(data, columns=columns, index=index)
+
+    def iter_chunks(self, chunksize, columns=None, rows=None, dates=()):
+        # Always yields at least one, possibly empty, chunk so the CSV header gets written
+        if rows is None:
+            for start in range(0, max(self.rows, 1), chunksize):
+                yield self.read(columns, start, start + chunksize, dates=dates)
+        else:
+            for start in range(0, max(len(rows), 1), chunksize):
+                yield self.read(columns, rows=rows[start:start + chunksize], dates=dates)
+
+    def _ensure_dates(self, column):
+        # Parse a date column once per file and keep it, with its sort order, in the sidecar
+        files = _date_files(self.directory, self._index[column])
+        if not all(os.path.exists(path) for path in files):
+            parsed = parse_dates(pd.Series(self._decode(column, slice(None))), self.date_formats.get(column))
+            parsed = parsed.to_numpy(dtype='datetime64[ns]')
+            index = DateIndex.build(parsed)
+            for path, values in zip(files, (parsed, index.order, index.sorted_values)):
+                _save_array(path, values)
+        return files
+
+    def read_dates(self, column, rows=slice(None)):
+        parsed_file = self._ensure_dates(column)[0]
+        return np.array(np.load(parsed_file, mmap_mode='r')[rows])
+
+    def date_index(self, column):
+        _, order_file, sorted_file = self._ensure_dates(column)
+        return DateIndex(np.load(order_file, mmap_mode='r'), np.load(sorted_file, mmap_mode='r'))
+
+
+def open_sidecar(csv_file_path):
+    """Return the ColumnarFile for an upload, or None if it is missing or stale."""
+    directory = sidecar_path(csv_file_path)
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if meta.get('version') != FORMAT_VERSION or meta.get('fingerprint') != file_fingerprint(csv_file_path):
+        return None
+    return ColumnarFile(directory, meta)
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def format_datetimes(series, unit='D'):
+    """Format a datetime column as ISO strings in one vectorized call, with None for NaT."""
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_localize(None)
+    values = series.to_numpy(dtype='datetime64[ns]')
+    formatted = np.datetime_as_string(values, unit=unit).astype(object)
+    formatted[np.isnat(values)] = None
+    return pd.Series(formatted, index=series.index, name=series.name)
+
+
+def encode_floats(series):
+    """
+    Encode a float column as a JSON array with null for NaN and infinities.
+    pandas' encoder keeps at most 15 significant digits, Python's float repr
+    is the shortest text that reads back as the same value.
+    """
+    values = series.to_numpy(dtype=object)
+    values[~np.isfinite(series.to_numpy(dtype=float))] = None
+    return json.dumps(values.tolist())
+
+
+def encode_columnar(df):
+    """
+    Encode `df` as column-oriented JSON bytes:
+    {"columns": [...], "data": [[first column values], [second column values], ...]}
+
+    Each column except float ones is written by pandas' C JSON encoder, so
+    no per-row Python objects are created.
+    """
+    encoded_columns = []
+    for name in df.columns:
+        series = df[name]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            series = format_datetimes(series)
+        if pd.api.types.is_float_dtype(series.dtype) or (
+            series.dtype == object and pd.api.types.infer_dtype(series) in ('floating', 'mixed-integer-float')
+        ):
+            encoded_columns.append(encode_floats(series))
+        else:
+            encoded_columns.append(series.to_json(orient='values'))
+
+    return b''.join([
+        b'{"columns":', json.dumps([str(name) for name in df.columns]).encode(),
+        b',"data":[', ','.join(encoded_columns).encode(), b']}',
+    ])
+
+
+def encode_preview_response(rows, **meta):
+    """JSON body for a preview response with `rows` encoded column-wise under "preview"."""
+    body = json.dumps(meta).encode()
+    return b'{"preview":' + encode_columnar(rows) + (b',' + body[1:] if meta else b'}')
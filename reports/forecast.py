@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from .dates import day_numbers, parse_dates
+
+
+# Linear trend forecasts for many series at once. Every series gets the
+# ordinary least squares line through its (day, value) points, computed in
+# closed form from per-group sums, so fitting thousands of series is a few
+# passes over the data instead of one model fit each:
+#   slope = sum((x - mean x) * (y - mean y)) / sum((x - mean x) ** 2)
+#   intercept = mean y - slope * mean x
+# Days are centered on their group's mean before squaring, which keeps the
+# sums exact enough for day numbers in the tens of thousands. A series
+# whose points all fall on one day gets a flat line through their mean, as
+# a least squares fit with a constant input does.
+
+
+def fit_trends(groups, days, values, n_groups):
+    """
+    Fit one line per group. `groups` holds each point's group number in
+    range(n_groups); returns (slopes, intercepts, last_days), one per group.
+    Groups without points get NaN.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_days = np.bincount(groups, days, n_groups) / counts
+        mean_values = np.bincount(groups, values, n_groups) / counts
+        centered = days - mean_days[groups]
+        spread = np.bincount(groups, centered * centered, n_groups)
+        covariance = np.bincount(groups, centered * (values - mean_values[groups]), n_groups)
+        slopes = np.where(spread > 0, covariance / np.where(spread > 0, spread, 1), 0.0)
+    slopes[counts == 0] = np.nan
+    intercepts = mean_values - slopes * mean_days
+
+    last_days = np.full(n_groups, np.iinfo(np.int64).min)
+    np.maximum.at(last_days, groups, days.astype(np.int64))
+    return slopes, intercepts, last_days
+
+
+def forecast_series(df, key=None, date_column='date', value_column='value', horizon=30):
+    """
+    Forecast the `horizon` days after the last date of every series in the
+    long-format frame `df`, one series per distinct value of the `key`
+    column (or a single series without one).
+
+    Returns (keys, dates, predictions): an Index of the series keys, and two
+    (len(keys), horizon) arrays with each series' future dates as
+    datetime64[D] and the predicted values. Rows with an unparseable date or
+    a missing value or key are ignored.
+    """
+    dates = parse_dates(df[date_column])
+    values = pd.to_numeric(df[value_column], errors='coerce').to_numpy(dtype=np.float64)
+    days = day_numbers(dates)
+    valid = dates.notna().to_numpy() & ~np.isnan(values)
+
+    if key is None:
+        groups, keys = np.zeros(int(valid.sum()), dtype=np.intp), pd.Index([None])
+    else:
+        valid &= df[key].notna().to_numpy()
+        groups, keys = pd.factorize(df[key].to_numpy()[valid])
+        keys = pd.Index(keys, name=key)
+    days, values = days[valid], values[valid]
+    if not len(days):
+        return keys[:0], np.empty((0, horizon), dtype='datetime64[D]'), np.empty((0, horizon))
+
+    slopes, intercepts, last_days = fit_trends(groups, days.astype(np.float64), values, len(keys))
+    future_days = last_days[:, None] + np.arange(1, horizon + 1)
+    predictions = intercepts[:, None] + slopes[:, None] * future_days
+    return keys, future_days.astype('datetime64[D]'), predictions
+
+
+def forecast_frame(df, key=None, date_column='date', value_column='value', horizon=30):
+    """forecast_series() as a long-format frame with one row per series and day."""
+    keys, dates, predictions = forecast_series(df, key, date_column, value_column, horizon)
+    frame = pd.DataFrame({
+        date_column: dates.ravel(),
+        value_column: predictions.ravel(),
+    })
+    if key is not None:
+        frame.insert(0, key, np.repeat(keys.to_numpy(), horizon))
+    return frame
@@ -10,6 +10,11 @@ class ReportForm(forms.ModelForm):
         required=False
     )
     
+    incremental = forms.BooleanField(
+        label="Only process rows appended to the CSV since the last run",
+        required=False
+    )
+
     information = forms.CharField(
         widget=forms.Textarea(attrs={'rows': 4}),
         label="Report Information",
@@ -18,4 +23,4 @@ class ReportForm(forms.ModelForm):
 
     class Meta:
         model = Report
-        fields = ['title', 'widgets', 'csv_file', 'information']
+        fields = ['title', 'widgets', 'csv_file', 'information', 'incremental']
@@ -0,0 +1,55 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from django.db import transaction
+
+from .dates import detect_date_format, parse_dates
+from .models import HistoricalData
+
+
+logger = logging.getLogger(__name__)
+
+LOAD_CHUNK_ROWS = 100000
+LOAD_BATCH_SIZE = 5000
+
+
+def iter_historical_chunks(csv_file, date_column='date', value_column='value', chunksize=LOAD_CHUNK_ROWS):
+    """
+    Parse a CSV path or file a chunk at a time and yield, per chunk, the
+    unsaved HistoricalData rows and the number of rows skipped because
+    their date or value doesn't parse.
+    """
+    date_format = None
+    with pd.read_csv(csv_file, usecols=[date_column, value_column], chunksize=chunksize) as reader:
+        for chunk in reader:
+            # The format of the first chunk is used for the whole file
+            date_format = date_format or detect_date_format(chunk[date_column])
+            dates = parse_dates(chunk[date_column], date_format)
+            values = pd.to_numeric(chunk[value_column], errors='coerce').to_numpy(dtype=np.float64)
+            valid = dates.notna().to_numpy() & ~np.isnan(values)
+            rows = [
+                HistoricalData(date=date, value=value)
+                for date, value in zip(dates[valid].dt.date, values[valid].tolist())
+            ]
+            yield rows, int((~valid).sum())
+
+
+def load_historical_csv(csv_file, date_column='date', value_column='value', replace=False, batch_size=LOAD_BATCH_SIZE):
+    """
+    Stream a CSV into HistoricalData with bulk inserts of `batch_size` rows,
+    all in one transaction, so a failed load leaves the table as it was.
+    With `replace` the existing rows are deleted first. Returns the number of
+    rows loaded and skipped.
+    """
+    loaded, skipped = 0, 0
+    with transaction.atomic():
+        if replace:
+            HistoricalData.objects.all().delete()
+        for rows, chunk_skipped in iter_historical_chunks(csv_file, date_column, value_column):
+            HistoricalData.objects.bulk_create(rows, batch_size=batch_size)
+            loaded += len(rows)
+            skipped += chunk_skipped
+    logger.info("Loaded %s historical rows, skipped %s", loaded, skipped)
+    return loaded, skipped
@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ReportJob
+from .operators import OperatorError
+from .utils import materialize_report
+
+
+logger = logging.getLogger(__name__)
+
+
+# Report generation runs outside the request. REPORTS_JOB_BACKEND picks where:
+#   'thread' - a pool of REPORTS_JOB_WORKERS threads inside the web process
+#   'orm'    - jobs stay queued in the database for `manage.py run_report_worker`
+#   'sync'   - inline, before the request returns (tests and debugging)
+# A job whose process dies, e.g. on a restart, stays 'running' without a
+# heartbeat or, with the thread backend, 'queued' in a pool that is gone;
+# recover_jobs() picks both up again.
+
+FAILED_MESSAGE = "Report generation failed. Please try again or contact an administrator."
+INTERRUPTED_MESSAGE = "Report generation was interrupted. Please regenerate the report."
+
+_executor = None
+_executor_lock = threading.Lock()
+_submitted = set()  # Jobs handed to this process's pool that haven't finished
+_last_recovery = 0.0
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REPORTS_JOB_WORKERS, thread_name_prefix='report-job'
+            )
+        return _executor
+
+
+def enqueue_report_generation(report, user, widget_ids):
+    widget_ids = list(widget_ids)
+    job = ReportJob.objects.create(
+        report=report, user=user, widget_ids=widget_ids, total_steps=len(widget_ids)
+    )
+
+    backend = settings.REPORTS_JOB_BACKEND
+    if backend == 'sync':
+        run_job(job.pk)
+    elif backend == 'thread':
+        # Only hand the job over once the rows it reads are committed
+        transaction.on_commit(lambda: submit_job(job.pk))
+    return job
+
+
+def submit_job(job_id):
+    with _executor_lock:
+        if job_id in _submitted:
+            return
+        _submitted.add(job_id)
+    get_executor().submit(_run_in_thread, job_id)
+
+
+def claim_job(job_id):
+    """Atomically move a queued job to running. Returns False if another worker got it first."""
+    now = timezone.now()
+    return ReportJob.objects.filter(pk=job_id, status=ReportJob.QUEUED).update(
+        status=ReportJob.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+    ) == 1
+
+
+def recover_jobs(force=False):
+    """
+    Queue running jobs that stopped sending heartbeats again, or fail them
+    once they ran REPORTS_JOB_MAX_ATTEMPTS times. With the thread backend,
+    also submit queued jobs that no pool in this process holds, so jobs of a
+    restarted process run. At most once per heartbeat interval unless `force`.
+    """
+    global _last_recovery
+    with _executor_lock:
+        if not force and time.monotonic() - _last_recovery < settings.REPORTS_JOB_HEARTBEAT_SECONDS:
+            return
+        _last_recovery = time.monotonic()
+
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.REPORTS_JOB_STALE_SECONDS)
+    stale = ReportJob.objects.filter(status=ReportJob.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    failed = stale.filter(attempts__gte=settings.REPORTS_JOB_MAX_ATTEMPTS).update(
+        status=ReportJob.FAILED, error=INTERRUPTED_MESSAGE, finished_at=now
+    )
+    requeued = stale.update(status=ReportJob.QUEUED, steps_done=0, started_at=None, heartbeat_at=None)
+    if failed or requeued:
+        logger.warning("Requeued %s and failed %s report job(s) that lost their worker", requeued, failed)
+
+    if settings.REPORTS_JOB_BACKEND == 'thread':
+        for job_id in ReportJob.objects.filter(status=ReportJob.QUEUED).values_list('pk', flat=True):
+            submit_job(job_id)
+
+
+def claim_next_job():
+    recover_jobs()
+    for job_id in ReportJob.objects.filter(status=ReportJob.QUEUED).order_by('created_at').values_list('pk', flat=True):
+        if claim_job(job_id):
+            return job_id
+    return None
+
+
+def run_job(job_id):
+    if claim_job(job_id):
+        execute_job(job_id)
+
+
+def execute_job(job_id):
+    """Run a job that was already claimed and record how it ended."""
+    job = ReportJob.objects.select_related('report', 'user').get(pk=job_id)
+
+    def on_step(index, df):
+        ReportJob.objects.filter(pk=job_id).update(steps_done=index + 1, heartbeat_at=timezone.now())
+
+    stats = []
+    try:
+        with Heartbeat(job_id):
+            materialize_report(job.user, job.widget_ids, job.report.csv_file, job.report, on_step=on_step, stats=stats)
+    except Exception as e:
+        # The traceback goes to the logs, the report page shows the message
+        logger.exception("Report job %s failed", job_id)
+        ReportJob.objects.filter(pk=job_id).update(
+            status=ReportJob.FAILED, error=failure_message(e), stats=stats, finished_at=timezone.now()
+        )
+    else:
+        ReportJob.objects.filter(pk=job_id).update(
+            status=ReportJob.DONE, steps_done=job.total_steps, stats=stats, finished_at=timezone.now()
+        )
+
+
+def failure_message(error):
+    # Widget errors name the widget and what went wrong, anything else is an internal error
+    return str(error) if isinstance(error, OperatorError) else FAILED_MESSAGE
+
+
+class Heartbeat:
+    """Refresh a running job's heartbeat_at from a background thread, so a long widget doesn't look stale."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        try:
+            while not self._stop.wait(settings.REPORTS_JOB_HEARTBEAT_SECONDS):
+                ReportJob.objects.filter(pk=self.job_id, status=ReportJob.RUNNING).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        with _executor_lock:
+            _submitted.discard(job_id)
+        connection.close()
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+from datetime import date, datetime
+
+import pandas as pd
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.benchmarks import (
+    DATE_DISTRIBUTIONS, DEFAULT_CHAIN, DEFAULT_START_DATE, Benchmark, compare_results, environment,
+    write_synthetic_csv,
+)
+
+
+def parse_size(value):
+    # Accept 1000, 1_000 and 1e3 alike
+    return int(float(value.replace('_', '')))
+
+
+class Command(BaseCommand):
+    help = "Time the report pipeline on synthetic CSVs of increasing size and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1e3,1e4,1e5,1e6', help="Comma separated row counts, e.g. 1e3,1e5,1e7.")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per benchmark.")
+        parser.add_argument('--duplicates', type=float, default=0.05, help="Fraction of rows repeating an earlier customer.")
+        parser.add_argument('--date-start', type=date.fromisoformat, default=DEFAULT_START_DATE)
+        parser.add_argument('--date-end', type=date.fromisoformat, default=date.today())
+        parser.add_argument('--date-distribution', choices=DATE_DISTRIBUTIONS, default='uniform')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chain', default=','.join(DEFAULT_CHAIN), help="Comma separated widget names for the chain benchmarks.")
+        parser.add_argument('--sample-csv', default=os.path.join(settings.BASE_DIR, 'customers-100.csv'),
+                            help="CSV the synthetic text values are drawn from.")
+        parser.add_argument('--data-dir', help="Keep the generated CSVs here and reuse them on later runs.")
+        parser.add_argument('--output', default='report-benchmark.json', help="Where to write the results.")
+        parser.add_argument('--compare', help="Results file of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of row counts.")
+        chain = [name.strip() for name in options['chain'].split(',') if name.strip()]
+        sample = pd.read_csv(options['sample_csv'])
+
+        config = {
+            key: str(options[key]) if isinstance(options[key], date) else options[key]
+            for key in ('repeat', 'duplicates', 'date_start', 'date_end', 'date_distribution', 'seed')
+        }
+        config.update(sizes=sizes, chain=chain)
+        run = {'created_at': datetime.now().isoformat(), 'environment': environment(), 'config': config, 'results': []}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = options['data_dir'] or tmp_dir
+            os.makedirs(data_dir, exist_ok=True)
+            for rows in sizes:
+                path = os.path.join(data_dir, 'synthetic-{}-{}-{}-{}-{}-{}.csv'.format(
+                    rows, options['duplicates'], options['date_start'], options['date_end'],
+                    options['date_distribution'], options['seed'],
+                ))
+                if not os.path.exists(path):
+                    self.stdout.write(f"Generating {rows} rows into {path}")
+                    write_synthetic_csv(
+                        path, rows, sample, options['duplicates'], options['date_start'], options['date_end'],
+                        options['date_distribution'], options['seed'],
+                    )
+
+                self.stdout.write(f"Benchmarking {rows} rows")
+                results = Benchmark(path, rows, options['repeat'], chain).run()
+                for result in results:
+                    self.stdout.write(f"  {result['benchmark']:<36} {result['min']:>10.4f}s  median {result['median']:.4f}s")
+                run['results'] += results
+
+        with open(options['output'], 'w') as f:
+            json.dump(run, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(run['results'])} results to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"Compared with {options['compare']} (commit {baseline['environment'].get('commit')}):")
+            for rows, name, before, after, ratio in compare_results(run, baseline):
+                line = f"  {rows:>10} {name:<36} {before:>10.4f}s -> {after:>10.4f}s  x{ratio:.2f}"
+                self.stdout.write(self.style.WARNING(line) if ratio > 1.1 else line)
@@ -0,0 +1,46 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from reports.models import Report
+from reports.storage import upload_storage
+
+
+class Command(BaseCommand):
+    help = "Move the CSVs referenced by reports into the content-addressed upload store."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-originals', action='store_true',
+            help="Delete each original file once no report references it anymore.",
+        )
+
+    def handle(self, *args, **options):
+        moved, missing = 0, 0
+        originals = set()
+        for report in Report.objects.exclude(csv_file='').exclude(csv_file__isnull=True):
+            path = report.csv_file.name
+            if upload_storage.owns(path):
+                continue
+            if not os.path.exists(path):
+                missing += 1
+                self.stderr.write(f"Report {report.pk}: {path} does not exist, skipping.")
+                continue
+            # update() skips the save signals, the original is handled below
+            with upload_storage.lock():
+                Report.objects.filter(pk=report.pk).update(csv_file=upload_storage.save_path(path))
+            originals.add(path)
+            moved += 1
+
+        deleted = 0
+        if options['delete_originals']:
+            for path in originals:
+                if not Report.objects.filter(csv_file=path).exists():
+                    os.unlink(path)
+                    deleted += 1
+
+        stored = {report_path for report_path in Report.objects.values_list('csv_file', flat=True) if upload_storage.owns(report_path)}
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} report(s) onto {len(stored)} stored file(s), "
+            f"deleted {deleted} original(s), {missing} missing."
+        ))
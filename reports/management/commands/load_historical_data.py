@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reports.historical import LOAD_BATCH_SIZE, load_historical_csv
+
+
+class Command(BaseCommand):
+    help = "Bulk load a CSV of dated values into HistoricalData in a single transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--date-column', default='date')
+        parser.add_argument('--value-column', default='value')
+        parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE, help="Rows per INSERT.")
+        parser.add_argument('--replace', action='store_true', help="Delete the existing rows first.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            loaded, skipped = load_historical_csv(
+                options['csv_file'], options['date_column'], options['value_column'],
+                replace=options['replace'], batch_size=options['batch_size'],
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load {options['csv_file']}: {e}")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {loaded} row(s) in {elapsed:.2f}s ({loaded / elapsed if elapsed else 0:.0f} rows/s), "
+            f"skipped {skipped} unparseable row(s)."
+        ))
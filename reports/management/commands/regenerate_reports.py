@@ -0,0 +1,82 @@
+import os
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from reports.models import Report, ReportJob
+from reports.regeneration import regenerate_reports
+
+
+def last_line(error):
+    lines = error.strip().splitlines()
+    return lines[-1] if lines else 'unknown error'
+
+
+class Command(BaseCommand):
+    help = "Regenerate many reports at once across a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help="Only reports of this username (repeatable).")
+        parser.add_argument('--widget', action='append', type=int, default=[],
+                            help="Only reports using the widget with this id (repeatable).")
+        parser.add_argument('--created-after', type=date.fromisoformat, help="Only reports created on or after this date.")
+        parser.add_argument('--created-before', type=date.fromisoformat, help="Only reports created on or before this date.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes. Each one also starts its own sandbox pool for custom code, "
+                                 "so consider lowering REPORTS_SANDBOX_WORKERS for large values.")
+
+    def handle(self, *args, **options):
+        reports = Report.objects.select_related('user').order_by('pk')
+        if options['user']:
+            reports = reports.filter(user__username__in=options['user'])
+        if options['widget']:
+            reports = reports.filter(widgets__in=options['widget']).distinct()
+        if options['created_after']:
+            reports = reports.filter(created_at__date__gte=options['created_after'])
+        if options['created_before']:
+            reports = reports.filter(created_at__date__lte=options['created_before'])
+        reports = list(reports)
+        if not reports:
+            self.stdout.write("No reports match.")
+            return
+
+        self.stdout.write(f"Regenerating {len(reports)} report(s) with {options['workers']} worker(s)")
+        started = time.perf_counter()
+        counts = {ReportJob.DONE: 0, ReportJob.FAILED: 0, 'skipped': 0}
+        busy = 0.0
+        failures = []
+        for event in regenerate_reports(reports, options['workers']):
+            if event[0] == 'prepared':
+                _, path, seconds, error = event
+                busy += seconds
+                if error:
+                    # Its reports fail below, their tracebacks are logged
+                    self.stderr.write(f"Could not parse {path}: {last_line(error)}")
+                continue
+
+            _, job, seconds, error = event
+            counts[job.status] = counts.get(job.status, 0) + 1
+            busy += seconds
+            if job.status == ReportJob.FAILED:
+                failures.append((job, error))
+                self.stderr.write(f"Report {job.report_id} failed (job {job.pk})")
+            else:
+                self.stdout.write(f"Report {job.report_id} {job.status} in {seconds:.2f}s")
+
+        elapsed = time.perf_counter() - started
+        finished = counts[ReportJob.DONE] + counts[ReportJob.FAILED]
+        # Share of the workers' time spent running reports, close to 1 when the pool scales well
+        utilization = busy / (elapsed * options['workers']) if elapsed else 0.0
+        self.stdout.write(
+            f"{finished} report(s) in {elapsed:.2f}s: {finished / elapsed if elapsed else 0:.2f} reports/s, "
+            f"worker utilization {utilization:.0%}"
+        )
+        for job, error in failures:
+            self.stdout.write(self.style.ERROR(f"  report {job.report_id} (job {job.pk}): {last_line(error)}"))
+
+        summary = (
+            f"{counts[ReportJob.DONE]} done, {counts[ReportJob.FAILED]} failed, "
+            f"{counts['skipped']} picked up by another worker."
+        )
+        self.stdout.write(self.style.ERROR(summary) if failures else self.style.SUCCESS(summary))
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from reports.jobs import claim_next_job, execute_job
+
+
+class Command(BaseCommand):
+    help = "Run queued report generation jobs from the database (REPORTS_JOB_BACKEND = 'orm')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Number of jobs to run concurrently.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is drained.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Starting {options['workers']} report worker(s)")
+        threads = [
+            threading.Thread(target=self.work, args=(options['poll_interval'], options['once']), daemon=True)
+            for _ in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping report workers")
+
+    def work(self, poll_interval, once):
+        try:
+            while True:
+                job_id = claim_next_job()
+                if job_id is None:
+                    if once:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                self.stdout.write(f"Running report job {job_id}")
+                execute_job(job_id)
+        finally:
+            connection.close()
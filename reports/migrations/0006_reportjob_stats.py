@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='stats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0006_reportjob_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+    ]
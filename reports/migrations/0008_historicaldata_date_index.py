@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0007_report_incremental'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicaldata',
+            name='date',
+            field=models.DateField(db_index=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
 from django.conf import settings
 from widgets.models import Widget
 
@@ -10,13 +12,101 @@ class Report(models.Model):
     information = models.TextField(blank=True)  # Optional information field
     csv_file = models.FileField(upload_to='reports/csvs/', blank=True, null=True)
     widgets = models.ManyToManyField(Widget, blank=True)
+    incremental = models.BooleanField(default=False)  # Only process rows appended to the CSV since the last run
 
     def __str__(self):
         return f"{self.title} - {self.created_at.strftime('%Y-%m-%d')}"
 
+class HistoricalDataQuerySet(models.QuerySet):
+    PERIODS = {
+        'day': TruncDay,
+        'week': TruncWeek,  # Weeks start on Monday
+        'month': TruncMonth,
+    }
+    AGGREGATES = {
+        'sum': Sum,
+        'avg': Avg,
+        'min': Min,
+        'max': Max,
+        'count': Count,
+    }
+
+    def between(self, start=None, end=None):
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(date__gte=start)
+        if end is not None:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
+
+    def aggregate_by(self, period='day', aggregate='sum'):
+        """
+        One row per day, week or month, computed by the database: a dict
+        with the first `date` of the period, the aggregated `value` and the
+        number of rows `count`, ordered by date. The rows can be passed
+        straight to pd.DataFrame and on to the forecaster.
+        """
+        if period not in self.PERIODS:
+            raise ValueError(f"Unknown period {period!r}, expected one of {', '.join(self.PERIODS)}.")
+        if aggregate not in self.AGGREGATES:
+            raise ValueError(f"Unknown aggregate {aggregate!r}, expected one of {', '.join(self.AGGREGATES)}.")
+        return (
+            self.annotate(period=self.PERIODS[period]('date'))
+            .values('period')
+            .annotate(value=self.AGGREGATES[aggregate]('value'), count=Count('id'))
+            .values('value', 'count', date=F('period'))
+            .order_by('period')
+        )
+
+
 class HistoricalData(models.Model):
-    date = models.DateField()
+    date = models.DateField(db_index=True)
     value = models.FloatField()  # e.g., sales value or other numerical data
 
+    objects = HistoricalDataQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.date}: {self.value}"
+
+
+class ReportJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, related_name='jobs')
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    widget_ids = models.JSONField(default=list)  # Ordered widget ids to apply
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    steps_done = models.PositiveIntegerField(default=0)
+    total_steps = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    stats = models.JSONField(default=list, blank=True)  # Per-widget timings and row/column/byte counts
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Refreshed while running, see recover_jobs()
+    attempts = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        if self.status == self.DONE:
+            return 1.0
+        return self.steps_done / self.total_steps if self.total_steps else 0.0
+
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    def __str__(self):
+        return f"Job {self.pk} for {self.report.title} ({self.status})"
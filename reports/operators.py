@@ -0,0 +1,544 @@
+import hashlib
+import inspect
+import logging
+import re
+import threading
+import time
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+
+from .dates import day_number, day_numbers, parse_dates, timestamp, timestamps
+from .schema import plain_dtypes
+
+
+logger = logging.getLogger(__name__)
+
+# Registry of built-in widget operators, keyed by Widget.name
+OPERATORS = {}
+
+
+class OperatorError(Exception):
+    """Raised when a widget fails while being applied to a DataFrame."""
+
+    def __init__(self, widget_name, message=None):
+        self.widget_name = widget_name
+        super().__init__(message or f"Error applying {widget_name}")
+
+
+def register(name):
+    """Class decorator that registers an operator for the widget called `name`."""
+    def decorator(cls):
+        cls.widget_name = name
+        OPERATORS[name] = cls
+        return cls
+    return decorator
+
+
+# Compiled Widget.code, keyed by (widget id, code hash)
+_compiled_code = {}
+_compiled_code_lock = threading.Lock()
+
+
+def code_hash(code):
+    return hashlib.sha256((code or '').encode()).hexdigest()
+
+
+def compile_widget_code(code, widget_id=None):
+    """Compile widget code to a code object, once per (widget id, code hash)."""
+    key = (widget_id, code_hash(code))
+    with _compiled_code_lock:
+        code_object = _compiled_code.get(key)
+    if code_object is None:
+        code_object = compile(code, f'<widget {widget_id}>', 'exec')
+        with _compiled_code_lock:
+            _compiled_code[key] = code_object
+    return code_object
+
+
+def forget_widget_code(widget_id):
+    with _compiled_code_lock:
+        for key in [key for key in _compiled_code if key[0] == widget_id]:
+            del _compiled_code[key]
+
+
+def _accepts_only_df(function):
+    parameters = inspect.signature(function).parameters.values()
+    required = [
+        parameter for parameter in parameters
+        if parameter.default is parameter.empty
+        and parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+    ]
+    return len(required) == 1
+
+
+def resolve_entry_point(namespace, code_object, widget_name=None):
+    """
+    Find the function widget code defines to transform a DataFrame: the one
+    named after the widget (e.g. `row_deduplicator` for "Row Deduplicator"),
+    else `transform`, else the last function defined that takes only `df`.
+    """
+    functions = {
+        name: value for name, value in namespace.items()
+        if inspect.isfunction(value) and value.__code__.co_filename == code_object.co_filename
+    }
+    candidates = []
+    if widget_name:
+        candidates.append(re.sub(r'\W+', '_', widget_name.strip().lower()))
+    candidates.append('transform')
+    for name in candidates:
+        if name in functions and _accepts_only_df(functions[name]):
+            return functions[name]
+    callable_functions = [function for function in functions.values() if _accepts_only_df(function)]
+    return callable_functions[-1] if callable_functions else None
+
+
+def execute_generated_code(generated_code, df, widget_id=None, widget_name=None):
+    # Sandbox setup: Create the environment the code runs in
+    namespace = {'df': df, 'pd': pd, 'np': np, 'datetime': datetime, 'timedelta': timedelta}
+
+    try:
+        code_object = compile_widget_code(generated_code, widget_id)
+        exec(code_object, namespace)
+
+        # Code that defines an entry point gets called with the DataFrame. It may
+        # return a new DataFrame or modify the one it was given in place.
+        entry_point = resolve_entry_point(namespace, code_object, widget_name)
+        if entry_point is not None:
+            result = entry_point(df)
+            return df if result is None else result
+
+        # Otherwise the code is a script that is expected to rebind `df`
+        if 'df' in namespace:
+            return namespace['df']
+        else:
+            raise ValueError("Generated code did not return or modify the DataFrame as expected.")
+    except MemoryError:
+        # Running out of memory is not a bug in the widget, the sandbox reports it as a resource limit
+        raise
+    except Exception as e:
+        logger.warning("Error executing generated code for widget %s: %s", widget_id, e)
+        return None
+
+
+class Operator:
+    """
+    A typed, parameterized transformation backing a widget.
+
+    Operators never modify the DataFrame they receive in place, so a caller
+    can keep a reference to an intermediate result while later steps run.
+    """
+    widget_name = None
+    row_local = False  # True when each output row only depends on its input row
+    date_columns = ()  # Columns that must be parsed as datetimes before apply()
+    reads = ()  # Columns apply() looks at, None when it may look at any column
+    writes = ()  # Columns apply() changes the values of, None when it may change any column
+    drops = ()  # Columns removed from the output
+
+    def __init__(self, widget=None):
+        self.widget = widget
+
+    @property
+    def name(self):
+        return self.widget.name if self.widget is not None else self.widget_name
+
+    def params(self):
+        # Everything besides the widget itself that changes the operator's output
+        return ()
+
+    def signature(self):
+        widget_id = self.widget.pk if self.widget is not None else None
+        return (widget_id, type(self).__name__) + tuple(self.params())
+
+    def date_range(self):
+        # (column, start, end) in int64 nanoseconds if apply() only keeps the rows in that range
+        return None
+
+    @property
+    def append_safe(self):
+        # True when apply_appended() can transform rows appended to the input on their own
+        return self.row_local
+
+    def apply(self, df):
+        raise NotImplementedError
+
+    def apply_appended(self, df, state):
+        """
+        Apply to rows appended to the input since an earlier run. `state` is
+        what the previous call returned for this step (None on the first);
+        returns the output for the new rows and the state to keep.
+        """
+        if not self.append_safe:
+            raise NotImplementedError(f"{self.name} needs the whole input")
+        return self.apply(df), None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name!r}>"
+
+
+@register("Yesterday Trimmer")
+class YesterdayTrimmer(Operator):
+    row_local = True
+
+    def __init__(self, widget=None, column='date'):
+        super().__init__(widget)
+        self.column = column
+        self.date_columns = (column,)
+        self.reads = (column,)
+
+    def params(self):
+        # The result changes every day, so the date is part of the signature
+        return (self.column, (datetime.now() - timedelta(days=1)).date().isoformat())
+
+    def apply(self, df):
+        if self.column not in df.columns:
+            logger.debug("No '%s' column found, skipping %s.", self.column, self.name)
+            return df
+        yesterday = day_number((datetime.now() - timedelta(days=1)).date())
+        return df[day_numbers(df[self.column]) != yesterday]
+
+
+@register("Column Dropper")
+class ColumnDropper(Operator):
+    row_local = True
+
+    def __init__(self, widget=None, columns=("email", "website")):
+        super().__init__(widget)
+        self.columns = list(columns)
+        self.drops = tuple(columns)
+
+    def params(self):
+        return tuple(self.columns)
+
+    def apply(self, df):
+        return df.drop(columns=self.columns, errors='ignore')
+
+
+def upper(series):
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.str.upper()
+    # Uppercase each category once; categories that only differ in case are merged
+    category_codes, categories = pd.factorize(series.cat.categories.str.upper())
+    codes = series.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, category_codes.take(codes, mode='clip'), -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+
+
+@register("Uppercase Name Converter")
+class UppercaseNameConverter(Operator):
+    row_local = True
+
+    def __init__(self, widget=None, columns=("first name", "last name")):
+        super().__init__(widget)
+        self.columns = list(columns)
+        self.reads = tuple(columns)
+        self.writes = tuple(columns)
+
+    def params(self):
+        return tuple(self.columns)
+
+    def apply(self, df):
+        return df.assign(**{column: upper(df[column]) for column in self.columns})
+
+
+
+@register("Date Filter")
+class DateFilter(Operator):
+    row_local = True
+
+    def __init__(self, widget=None, start_date="2024-09-01", end_date="2024-10-12", column='date'):
+        super().__init__(widget)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.column = column
+        self.date_columns = (column,)
+        self.reads = (column,)
+
+    def params(self):
+        return (self.column, self.start_date, self.end_date)
+
+    def date_range(self):
+        return (self.column, timestamp(self.start_date), timestamp(self.end_date))
+
+    def apply(self, df):
+        _, start, end = self.date_range()
+        values = timestamps(df[self.column])
+        return df[(values >= start) & (values <= end)]
+
+
+def row_keys(df):
+    """A uint64 hash per row of `df`, equal for rows drop_duplicates() considers equal."""
+    return pd.util.hash_pandas_object(plain_dtypes(df), index=False).to_numpy()
+
+
+@register("Row Deduplicator")
+class RowDeduplicator(Operator):
+
+    def __init__(self, widget=None, subset=("customer id",)):
+        super().__init__(widget)
+        self.subset = list(subset)
+        self.reads = tuple(subset)
+
+    def params(self):
+        return tuple(self.subset)
+
+    # Appended rows are checked against the keys of the rows kept so far
+    append_safe = True
+
+    def apply(self, df):
+        return df.drop_duplicates(subset=self.subset)
+
+    def apply_appended(self, df, seen):
+        # `seen` is the sorted array of the row_keys() kept by earlier increments
+        keys = row_keys(df[self.subset])
+        keep = ~pd.Series(keys).duplicated().to_numpy()
+        if seen is not None and len(seen):
+            positions = np.searchsorted(seen, keys).clip(max=len(seen) - 1)
+            keep &= seen[positions] != keys
+        return df[keep], np.union1d(seen if seen is not None else keys[:0], keys[keep])
+
+
+class CustomCode(Operator):
+    """Runs the user supplied `Widget.code` against the DataFrame."""
+    reads = None
+    writes = None
+
+    def params(self):
+        return (code_hash(self.widget.code),)
+
+    def apply(self, df):
+        from .sandbox import SandboxError, get_sandbox
+
+        # Run the code in an isolated worker process when the sandbox is enabled
+        sandbox = get_sandbox()
+        if sandbox is not None:
+            try:
+                return sandbox.run_code(self.widget.code, df, self.widget.pk, self.widget.name)
+            except SandboxError as e:
+                raise OperatorError(self.name, str(e)) from e
+
+        # The generated code is free to mutate its input, so hand it a copy with plain object
+        # columns, the same dtypes it gets inside the sandbox
+        df = plain_dtypes(df)
+        result = execute_generated_code(self.widget.code, df.copy(), self.widget.pk, self.widget.name)
+        if result is None or not isinstance(result, pd.DataFrame):
+            raise OperatorError(self.name, f"Widget {self.name} failed to modify the CSV correctly.")
+        return result
+
+
+class Passthrough(Operator):
+    """Placeholder for widgets that have neither a built-in operator nor code."""
+    row_local = True
+
+    def apply(self, df):
+        return df
+
+
+def build_operator(widget):
+    operator_class = OPERATORS.get(widget.name)
+    if operator_class is not None:
+        return operator_class(widget)
+    if widget.code:
+        return CustomCode(widget)
+    return Passthrough(widget)
+
+
+class PlanStep:
+    def __init__(self, operator, parse_dates=()):
+        self.operator = operator
+        self.parse_dates = tuple(parse_dates)
+
+    def _parse_dates(self, df):
+        parsed = {
+            column: parse_dates(df[column])
+            for column in self.parse_dates
+            if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column].dtype)
+        }
+        return df.assign(**parsed) if parsed else df
+
+    def run(self, df):
+        return self.operator.apply(self._parse_dates(df))
+
+    def run_appended(self, df, state):
+        return self.operator.apply_appended(self._parse_dates(df), state)
+
+
+class ExecutionPlan:
+    """
+    An ordered list of steps compiled from a report's widgets, one per widget.
+
+    Compilation fuses redundant work across steps: a date column is parsed by
+    the first step that needs it and reused by every later one, instead of each
+    time-based widget calling `pd.to_datetime` again.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def row_local(self):
+        return all(step.operator.row_local for step in self.steps)
+
+    @property
+    def append_safe(self):
+        return all(step.operator.append_safe for step in self.steps)
+
+    def signatures(self):
+        return [step.operator.signature() for step in self.steps]
+
+    def required_columns(self, columns):
+        """
+        Return the subset of `columns` the plan needs from its input: every
+        column it reads, plus every column that survives to the output.
+        """
+        read, dropped = set(), set()
+        for step in self.steps:
+            if step.operator.reads is None:
+                return list(columns)
+            read.update(column for column in step.operator.reads if column not in dropped)
+            dropped.update(step.operator.drops)
+        return [column for column in columns if column not in dropped or column in read]
+
+    def _unchanged_columns(self):
+        # Yield each step with the columns changed before it, as long as every earlier
+        # step is row-local and declares the columns it writes
+        changed = set()
+        for step in self.steps:
+            yield step, changed
+            if step.operator.writes is None or not step.operator.row_local:
+                return
+            changed.update(step.operator.writes)
+            changed.update(step.operator.drops)
+
+    def input_date_range(self):
+        """
+        Return (column, start, end) for a date range filter that can be applied
+        while reading the input: every step before it is row-local and leaves
+        the column alone, so filtering first doesn't change the result.
+        """
+        for step, changed in self._unchanged_columns():
+            date_range = step.operator.date_range()
+            if date_range is not None and date_range[0] not in changed:
+                return date_range
+        return None
+
+    def input_date_columns(self):
+        """Date columns that may be parsed while reading the input instead of by a step."""
+        columns = set()
+        for step, changed in self._unchanged_columns():
+            columns.update(column for column in step.parse_dates if column not in changed)
+        return columns
+
+    def run(self, df, start=0, on_step=None, stats=None):
+        """
+        Apply the steps from `start` onwards. `df` must be the result of the
+        steps before `start`. `on_step(index, df)` is called after each step,
+        and the measure_step() dict of each step is appended to `stats` if it is a list.
+        """
+        for index in range(start, len(self.steps)):
+            df = self._run_step(index, df, self.steps[index].run, on_step, stats)
+        return df
+
+    def run_appended(self, df, states, on_step=None, stats=None):
+        """
+        Apply every step to rows appended to the input of an earlier run, with
+        the per-step `states` that run returned (see Operator.apply_appended).
+        Returns the output for the new rows and the states to keep.
+        """
+        states = list(states)
+
+        def run_step(index):
+            def run(step_df):
+                result, states[index] = self.steps[index].run_appended(step_df, states[index])
+                return result
+            return run
+
+        for index in range(len(self.steps)):
+            df = self._run_step(index, df, run_step(index), on_step, stats)
+        return df, states
+
+    def _run_step(self, index, df, run, on_step, stats):
+        step = self.steps[index]
+        started = time.perf_counter()
+        try:
+            result = run(df)
+        except OperatorError:
+            raise
+        except Exception as e:
+            raise OperatorError(step.operator.name) from e
+
+        step_stats = measure_step(step, df, result, time.perf_counter() - started)
+        logger.debug("Applied widget %(widget)s in %(seconds).4fs: %(rows_in)s -> %(rows_out)s rows", step_stats)
+        if stats is not None:
+            stats.append(step_stats)
+
+        if on_step is not None:
+            on_step(index, result)
+        return result
+
+
+def _column_buffers(df):
+    # Address and size of the data behind each column, read without copying
+    buffers = {}
+    for _, series in df.items():
+        if isinstance(series.dtype, np.dtype):
+            values = series.to_numpy()  # A view for NumPy-backed columns
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.array.codes
+        else:
+            continue
+        buffers[values.__array_interface__['data'][0]] = values.nbytes
+    return buffers
+
+
+def measure_step(step, df_in, df_out, seconds):
+    """
+    Describe one step of a run. `bytes_allocated` counts the column buffers of
+    the output that are not shared with the input: an estimate of the memory
+    the step allocated, taken without copying or walking any data.
+    """
+    buffers_in = _column_buffers(df_in)
+    buffers_out = _column_buffers(df_out)
+    return {
+        'widget': step.operator.name,
+        'widget_id': step.operator.widget.pk if step.operator.widget is not None else None,
+        'seconds': seconds,
+        'rows_in': len(df_in),
+        'rows_out': len(df_out),
+        'columns_in': len(df_in.columns),
+        'columns_out': len(df_out.columns),
+        'bytes_allocated': sum(nbytes for address, nbytes in buffers_out.items() if address not in buffers_in),
+    }
+
+
+def combine_step_stats(stats, n_steps):
+    """
+    Merge the measure_step() dicts of a plan run chunk by chunk, `n_steps`
+    per chunk, into one dict per step with the totals over all chunks.
+    """
+    combined = []
+    for index, step_stats in enumerate(stats):
+        if index < n_steps:
+            combined.append(dict(step_stats))
+            continue
+        total = combined[index % n_steps]
+        for key in ('seconds', 'rows_in', 'rows_out', 'bytes_allocated'):
+            total[key] += step_stats[key]
+    return combined
+
+
+def compile_plan(widgets):
+    steps = []
+    parsed = set()
+    for widget in widgets:
+        operator = build_operator(widget)
+        parse_dates = [column for column in operator.date_columns if column not in parsed]
+        parsed.update(parse_dates)
+        if isinstance(operator, CustomCode):
+            # Arbitrary code may have replaced any column, so parse again afterwards
+            parsed.clear()
+        steps.append(PlanStep(operator, parse_dates))
+    return ExecutionPlan(steps)
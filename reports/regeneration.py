@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.db import close_old_connections
+
+from .jobs import claim_job, execute_job
+from .models import ReportJob
+from .utils import ensure_columnar_cache, get_csv_path
+
+
+# Bulk regeneration runs every report as a ReportJob in a pool of worker
+# processes, so the results show up in the UI like any other run. It works in
+# two passes:
+#   1. every distinct CSV is parsed once, by one worker, into its columnar
+#      sidecar (uploads are content-addressed, so identical files share one)
+#   2. the reports are handed out one at a time, grouped by CSV; their reads
+#      memory-map the sidecar instead of parsing the text again
+# Workers are started with forkserver, like the sandbox pool, and set up
+# Django on their own; this module imports models, so it can only be loaded
+# once they have.
+
+
+def _prepare_csv(csv_file_path):
+    close_old_connections()
+    started = time.perf_counter()
+    try:
+        ensure_columnar_cache(csv_file_path)
+    except Exception:
+        return csv_file_path, time.perf_counter() - started, traceback.format_exc()
+    return csv_file_path, time.perf_counter() - started, ''
+
+
+def _run_job(job_id):
+    close_old_connections()
+    started = time.perf_counter()
+    if not claim_job(job_id):
+        # Picked up by a run_report_worker in the meantime
+        return job_id, 'skipped', 0.0, ''
+    execute_job(job_id)
+    status, error = ReportJob.objects.filter(pk=job_id).values_list('status', 'error').get()
+    return job_id, status, time.perf_counter() - started, error
+
+
+def create_jobs(reports):
+    """Queue one ReportJob per report, with the report's current widgets."""
+    jobs = []
+    for report in reports:
+        widget_ids = list(report.widgets.values_list('id', flat=True))
+        jobs.append(ReportJob.objects.create(
+            report=report, user=report.user, widget_ids=widget_ids, total_steps=len(widget_ids)
+        ))
+    return jobs
+
+
+def regenerate_reports(reports, workers=None):
+    """
+    Regenerate `reports` across `workers` processes (all cores by default).
+
+    Yields ('prepared', csv_file_path, seconds, error) once per distinct CSV, then
+    ('finished', job, seconds, error) once per report as it completes, where
+    job.status is 'done', 'failed' or 'skipped'.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = create_jobs(reports)
+    csv_paths = {job.pk: get_csv_path(job.report.csv_file) if job.report.csv_file else '' for job in jobs}
+    jobs.sort(key=lambda job: csv_paths[job.pk])
+    jobs_by_id = {job.pk: job for job in jobs}
+
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=django.setup) as executor:
+        distinct = sorted({path for path in csv_paths.values() if path})
+        for future in as_completed([executor.submit(_prepare_csv, path) for path in distinct]):
+            yield ('prepared',) + future.result()
+
+        for future in as_completed([executor.submit(_run_job, job.pk) for job in jobs]):
+            job_id, status, seconds, error = future.result()
+            job = jobs_by_id[job_id]
+            job.status = status
+            yield 'finished', job, seconds, error
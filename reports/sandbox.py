@@ -0,0 +1,260 @@
+import multiprocessing
+import queue
+import resource
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+
+
+# User widget code runs in a pool of long-lived worker processes with their
+# own CPU time and memory limits, so a runaway widget takes down a worker
+# instead of the web process. DataFrames are handed over column by column
+# through shared memory:
+#   - numeric, boolean and datetime columns as their values
+#   - text columns as dictionary codes plus their distinct values, joined
+#     into one UTF-8 string with an array of where each value ends
+#   - other object columns as dictionary codes; their distinct values are
+#     pickled into the message, the one part that grows with the data
+# so the message sent over the pipe stays small. It is not zero-copy: each
+# side copies the columns out of shared memory into its own frame, and text
+# is decoded into new strings, once per distinct value.
+
+
+class SandboxError(Exception):
+    pass
+
+
+def _to_shared(values, segments):
+    values = np.ascontiguousarray(values)
+    segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[:] = values
+    segments.append(segment)
+    return (segment.name, values.dtype.str, len(values))
+
+
+def _from_shared(spec):
+    name, dtype, length = spec
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray((length,), dtype=np.dtype(dtype), buffer=segment.buf).copy()
+    finally:
+        segment.close()
+
+
+def _text_to_shared(uniques, segments):
+    # Offsets count characters, so the other side decodes the whole text once and slices it
+    ends = np.cumsum([len(value) for value in uniques], dtype=np.int64)
+    text = np.frombuffer(''.join(uniques).encode('utf-8', 'surrogatepass'), dtype=np.uint8)
+    return _to_shared(ends, segments), _to_shared(text, segments)
+
+
+def _text_from_shared(ends_spec, text_spec):
+    ends = _from_shared(ends_spec).tolist()
+    text = _from_shared(text_spec).tobytes().decode('utf-8', 'surrogatepass')
+    values = np.empty(len(ends), dtype=object)
+    values[:] = [text[start:end] for start, end in zip([0] + ends[:-1], ends)]
+    return values
+
+
+def export_frame(df):
+    """
+    Describe `df` as a picklable payload whose column data lives in shared
+    memory. Returns (payload, segments); the caller closes the segments, and
+    whoever reads the payload last unlinks them.
+    """
+    segments = []
+    columns = []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype.kind in 'biufcmM':
+            columns.append((name, 'array', _to_shared(values, segments)))
+        else:
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            if pd.api.types.infer_dtype(uniques, skipna=False) == 'string':
+                columns.append((name, 'text', _to_shared(codes, segments)) + _text_to_shared(uniques, segments))
+            else:
+                columns.append((name, 'codes', _to_shared(codes, segments), np.asarray(uniques, dtype=object)))
+
+    index = df.index
+    if isinstance(index, pd.RangeIndex):
+        index_payload = ('range', index.start, index.stop, index.step)
+    else:
+        index_payload = ('array', _to_shared(index.to_numpy(), segments)) if index.dtype.kind in 'biufmM' else ('values', index)
+    return {'columns': columns, 'index': index_payload}, segments
+
+
+def import_frame(payload):
+    data = {}
+    for column in payload['columns']:
+        name, kind, spec = column[:3]
+        if kind == 'array':
+            data[name] = _from_shared(spec)
+        else:
+            codes = _from_shared(spec)
+            uniques = _text_from_shared(column[3], column[4]) if kind == 'text' else column[3]
+            decoded = uniques.take(codes) if len(uniques) else np.empty(len(codes), dtype=object)
+            decoded[codes < 0] = np.nan
+            data[name] = decoded
+
+    index = payload['index']
+    if index[0] == 'range':
+        index = pd.RangeIndex(index[1], index[2], index[3])
+    elif index[0] == 'array':
+        index = pd.Index(_from_shared(index[1]))
+    else:
+        index = index[1]
+    return pd.DataFrame(data, columns=[column[0] for column in payload['columns']], index=index)
+
+
+def payload_segment_names(payload):
+    names = []
+    for column in payload['columns']:
+        names.append(column[2][0])
+        if column[1] == 'text':
+            names.extend((column[3][0], column[4][0]))
+    if payload['index'][0] == 'array':
+        names.append(payload['index'][1][0])
+    return names
+
+
+def unlink_segments(names):
+    for name in names:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+
+
+def _worker_main(conn, cpu_seconds, memory_bytes):
+    from .operators import execute_generated_code
+
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        code, widget_id, widget_name, payload = task
+
+        # RLIMIT_CPU counts the whole life of the process, so extend it by the
+        # per-task budget. Going over it kills the worker with SIGXCPU.
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_seconds + 1, hard))
+
+        try:
+            result = execute_generated_code(code, import_frame(payload), widget_id, widget_name)
+            if not isinstance(result, pd.DataFrame):
+                conn.send(('error', f"Widget {widget_name} failed to modify the CSV correctly."))
+                continue
+            result_payload, segments = export_frame(result)
+            for segment in segments:
+                segment.close()
+            conn.send(('ok', result_payload))
+        except MemoryError:
+            conn.send(('error', f"Widget {widget_name} exceeded its memory limit."))
+        except Exception as e:
+            conn.send(('error', f"Widget {widget_name} failed: {e}"))
+
+
+class SandboxWorker:
+    def __init__(self, context, cpu_seconds, memory_bytes):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, cpu_seconds, memory_bytes), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    A fixed number of pre-started worker processes. Each task borrows an idle
+    worker; a worker that dies or overruns `wall_seconds` is replaced.
+    """
+
+    def __init__(self, size, cpu_seconds, memory_bytes, wall_seconds, start_method='forkserver'):
+        self.size = size
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.wall_seconds = wall_seconds
+        self.context = multiprocessing.get_context(start_method)
+        self._idle = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _spawn(self):
+        return SandboxWorker(self.context, self.cpu_seconds, self.memory_bytes)
+
+    def start(self):
+        with self._start_lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(self._spawn())
+                self._started = True
+
+    def run_code(self, code, df, widget_id=None, widget_name=None):
+        self.start()
+        payload, segments = export_frame(df)
+        for segment in segments:
+            segment.close()
+
+        worker = self._idle.get()
+        try:
+            worker.conn.send((code, widget_id, widget_name, payload))
+            if not worker.conn.poll(self.wall_seconds):
+                raise TimeoutError
+            status, result = worker.conn.recv()
+        except TimeoutError:
+            worker.kill()
+            worker = self._spawn()
+            raise SandboxError(f"Widget {widget_name} did not finish within {self.wall_seconds} seconds.")
+        except (EOFError, OSError):
+            # The worker died, most likely killed for exceeding its CPU time
+            worker.kill()
+            worker = self._spawn()
+            raise SandboxError(f"Widget {widget_name} was stopped for exceeding its resource limits.")
+        finally:
+            self._idle.put(worker)
+            unlink_segments(payload_segment_names(payload))
+
+        if status != 'ok':
+            raise SandboxError(result)
+        try:
+            return import_frame(result)
+        finally:
+            unlink_segments(payload_segment_names(result))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox():
+    """Return the process-wide sandbox pool, or None when REPORTS_SANDBOX_WORKERS is 0."""
+    global _pool
+    if not settings.REPORTS_SANDBOX_WORKERS:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(
+                size=settings.REPORTS_SANDBOX_WORKERS,
+                cpu_seconds=settings.REPORTS_SANDBOX_CPU_SECONDS,
+                memory_bytes=settings.REPORTS_SANDBOX_MEMORY_BYTES,
+                wall_seconds=settings.REPORTS_SANDBOX_WALL_SECONDS,
+            )
+        return _pool
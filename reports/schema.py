@@ -0,0 +1,173 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .cache import file_fingerprint
+from .dates import detect_date_format
+
+try:
+    import pyarrow
+except ImportError:  # Arrow-backed strings are optional, high-cardinality text stays object
+    pyarrow = None
+
+
+# The compact dtypes an upload is loaded with, inferred once from the whole
+# file and kept next to it as <csv>.schema.json:
+#   - text with few distinct values -> category
+#   - other text -> Arrow-backed strings when pyarrow is installed
+#   - integers -> the smallest integer type holding their range
+#   - floats -> float32 when that loses nothing
+# Date columns are recorded with their format, but read as text: the date
+# widgets parse them, so a report that doesn't filter on dates returns its
+# dates exactly as uploaded.
+
+SCHEMA_SUFFIX = '.schema.json'
+SCHEMA_VERSION = 1
+CATEGORY_RATIO = 0.5  # Most distinct values per non-missing value for a category column
+DATE_SHARE = 0.9  # Share of sampled values that must parse for a text column to count as dates
+
+STRING_DTYPE = 'string[pyarrow]' if pyarrow is not None else 'object'
+
+
+def schema_path(csv_file_path):
+    return str(csv_file_path) + SCHEMA_SUFFIX
+
+
+def infer_column_dtype(series):
+    if series.dtype == object:
+        if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+            return 'object'
+        present = series.count()
+        return 'category' if series.nunique() <= present * CATEGORY_RATIO else STRING_DTYPE
+
+    if pd.api.types.is_integer_dtype(series.dtype) and len(series):
+        return np.result_type(np.min_scalar_type(series.min()), np.min_scalar_type(series.max())).name
+
+    if pd.api.types.is_float_dtype(series.dtype):
+        values = series.to_numpy()
+        narrowed = values.astype(np.float32)
+        if np.array_equal(narrowed.astype(values.dtype), values, equal_nan=True):
+            return 'float32'
+
+    return str(series.dtype)
+
+
+def infer_date_format(series, sample_size=1000):
+    """The format of a text column if it holds dates, otherwise None."""
+    if series.dtype != object:
+        return None
+    sample = series.iloc[:sample_size].dropna()
+    date_format = detect_date_format(sample)
+    if date_format is None:
+        return None
+    parsed = pd.to_datetime(sample, format=date_format, errors='coerce')
+    return date_format if parsed.notna().mean() >= DATE_SHARE else None
+
+
+def infer_schema(df):
+    dates = {}
+    for column in df.columns:
+        date_format = infer_date_format(df[column])
+        if date_format is not None:
+            dates[column] = date_format
+    return {
+        'version': SCHEMA_VERSION,
+        'dtypes': {column: infer_column_dtype(df[column]) for column in df.columns},
+        'dates': dates,
+    }
+
+
+def has_dtype(series, dtype):
+    if dtype == 'category':
+        return isinstance(series.dtype, pd.CategoricalDtype)
+    return series.dtype == pd.api.types.pandas_dtype(dtype)
+
+
+def cast_losslessly(series, dtype):
+    """
+    Return `series` converted to `dtype`, or None when that would change a
+    value: astype() wraps integers that overflow the target instead of
+    raising, and rounds floats that float32 can't represent.
+    """
+    target = pd.api.types.pandas_dtype(dtype)
+    numeric = isinstance(target, np.dtype) and target.kind in 'iuf'
+    if numeric and series.dtype.kind not in 'biuf':
+        # Text the CSV parser couldn't read as numbers
+        return None
+    try:
+        converted = series.astype(target)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if numeric:
+        values = series.to_numpy()
+        if not np.array_equal(converted.to_numpy().astype(values.dtype), values, equal_nan=values.dtype.kind == 'f'):
+            return None
+    return converted
+
+
+def apply_schema(df, schema):
+    """
+    Convert the columns of `df` that the schema knows about to their compact
+    dtype. A column with values the compact dtype can't hold, e.g. a chunk
+    read from the CSV with larger numbers than the rest, keeps its parsed dtype.
+    """
+    dtypes = {
+        column: dtype for column, dtype in schema['dtypes'].items()
+        if column in df.columns and not has_dtype(df[column], dtype)
+    }
+    for column, dtype in dtypes.items():
+        converted = cast_losslessly(df[column], dtype)
+        if converted is not None:
+            df[column] = converted
+    return df
+
+
+def fits_schema(df, schema):
+    """Whether every column of `df` the schema knows about has its dtype, e.g. after apply_schema()."""
+    return all(has_dtype(df[column], dtype) for column, dtype in schema['dtypes'].items() if column in df.columns)
+
+
+def save_schema(csv_file_path, schema):
+    schema = dict(schema, fingerprint=file_fingerprint(csv_file_path))
+    path = schema_path(csv_file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(schema, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_schema(csv_file_path):
+    """Return the stored schema of an upload, or None if it is missing or stale."""
+    try:
+        with open(schema_path(csv_file_path)) as f:
+            schema = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if schema.get('version') != SCHEMA_VERSION or schema.get('fingerprint') != file_fingerprint(csv_file_path):
+        return None
+    return schema
+
+
+def plain_dtypes(df):
+    """
+    Return `df` with category and Arrow string columns converted back to
+    object columns holding NaN for missing values, the dtypes user supplied
+    widget code was written against.
+    """
+    compact = [
+        column for column, dtype in df.dtypes.items()
+        if isinstance(dtype, (pd.CategoricalDtype, pd.StringDtype, pd.ArrowDtype))
+    ]
+    if not compact:
+        return df
+    return df.assign(**{
+        column: df[column].astype(object).where(df[column].notna(), np.nan) for column in compact
+    })
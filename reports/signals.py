@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from widgets.models import Widget
+from .appends import append_store
+from .catalog import widget_catalog
+from .models import Report
+from .operators import forget_widget_code
+from .storage import upload_storage
+
+
+@receiver(pre_save, sender=Report)
+def remember_previous_csv_file(sender, instance, **kwargs):
+    if instance.pk:
+        instance._previous_csv_file = (
+            Report.objects.filter(pk=instance.pk).values_list('csv_file', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Report)
+def release_replaced_csv_file(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_csv_file', None)
+    if previous and previous != instance.csv_file.name:
+        # Once committed: release() takes the upload store's lock, which an upload holds while saving its report
+        transaction.on_commit(lambda: upload_storage.release(previous))
+
+
+@receiver(post_delete, sender=Report)
+def release_deleted_csv_file(sender, instance, **kwargs):
+    if instance.csv_file:
+        path = instance.csv_file.name
+        transaction.on_commit(lambda: upload_storage.release(path))
+
+
+@receiver(post_delete, sender=Report)
+def discard_appended_results(sender, instance, **kwargs):
+    append_store.discard(instance.pk)
+
+
+@receiver(post_save, sender=Widget)
+@receiver(post_delete, sender=Widget)
+def forget_widget(sender, instance, **kwargs):
+    forget_widget_code(instance.pk)
+    widget_catalog.invalidate()
+    # Again once committed, in case another thread cached the old row in the meantime
+    transaction.on_commit(widget_catalog.invalidate)
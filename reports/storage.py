@@ -0,0 +1,123 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+from .cache import file_fingerprint, remember_fingerprint
+from .columnar import sidecar_path
+from .schema import schema_path
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Upload storage that names files after the SHA-256 of their content.
+
+    Saving content that is already stored returns the existing path instead of
+    writing another copy, so every report built from the same CSV shares the
+    file and everything derived from it (columnar sidecar, cached previews and
+    artifacts). Files are reference counted through `Report.csv_file` and
+    removed by `release()` once no report points at them.
+
+    Saving a file and the Report that references it must happen under
+    `lock()`, which release() takes as well: otherwise a release could count
+    no references to a file an upload of the same content just returned, and
+    delete it before that upload's report is saved.
+    """
+
+    def __init__(self, location=None, **kwargs):
+        super().__init__(location=location or settings.REPORTS_UPLOAD_DIR, **kwargs)
+        self._held = threading.local()
+
+    @contextmanager
+    def lock(self):
+        """Hold the store-wide lock, across processes. Reentrant within a thread."""
+        if getattr(self._held, 'depth', 0):
+            # e.g. release() from the post_save signal of a report saved under the lock
+            self._held.depth += 1
+            try:
+                yield
+            finally:
+                self._held.depth -= 1
+            return
+
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, '.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self._held.depth = 1
+            try:
+                yield
+            finally:
+                self._held.depth = 0
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save_upload(self, uploaded_file):
+        """Store an UploadedFile and return its absolute path."""
+        fingerprint = getattr(uploaded_file, 'sha256', None)
+        if fingerprint is not None:
+            # Received into this directory and hashed by CSVUploadHandler, only needs a rename
+            return self._commit(uploaded_file.temporary_file_path(), fingerprint)
+
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in uploaded_file.chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            return self._commit(tmp_path, digest.hexdigest())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def save_path(self, path):
+        """Copy an existing file on disk into the store and return its new path."""
+        digest = file_fingerprint(path)
+        os.makedirs(self.location, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.location, suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        return self._commit(tmp_path, digest)
+
+    def _commit(self, tmp_path, fingerprint):
+        name = os.path.join(fingerprint[:2], fingerprint + '.csv')
+        path = self.path(name)
+        with self.lock():
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            remember_fingerprint(path, fingerprint)
+        return path
+
+    def owns(self, path):
+        location = os.path.join(os.path.abspath(self.location), '')
+        return bool(path) and os.path.abspath(path).startswith(location)
+
+    def reference_count(self, path):
+        from .models import Report
+        return Report.objects.filter(csv_file=path).count()
+
+    def release(self, path):
+        """Delete a stored upload and its derived files if no report references it anymore."""
+        if not self.owns(path):
+            return False
+        with self.lock():
+            if self.reference_count(path):
+                return False
+            for stored_path in (path, schema_path(path)):
+                if os.path.exists(stored_path):
+                    os.unlink(stored_path)
+            shutil.rmtree(sidecar_path(path), ignore_errors=True)
+        return True
+
+
+upload_storage = ContentAddressedStorage()
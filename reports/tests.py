@@ -1,3 +1,755 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from widgets.models import Widget
+from . import async_views, views
+from .appends import AppendStore
+from .artifacts import artifact_store
+from .cache import PrefixCache, frame_nbytes, preview_cache
+from .catalog import WidgetCatalog
+from .columnar import open_sidecar, sidecar_path, write_sidecar
+from .dates import detect_date_format, parse_dates
+from .encoders import encode_columnar
+from .forecast import forecast_series
+from .jobs import FAILED_MESSAGE, INTERRUPTED_MESSAGE, claim_job, execute_job, recover_jobs
+from .historical import load_historical_csv
+from .models import HistoricalData, Report, ReportJob
+from .operators import ColumnDropper, compile_plan, execute_generated_code, forget_widget_code
+from .sandbox import SandboxError, SandboxPool
+from .schema import apply_schema, infer_schema
+from .storage import ContentAddressedStorage, upload_storage
+from .utils import (
+    build_columnar_cache, frame_to_records, head_rows, read_report_csv, reservoir_sample, run_preview_plan,
+    save_report_data,
+)
+
+
+def make_temp_dir(test):
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
+def baseline_report(widget_names, df):
+    # The widget chain as generate_report applied it before plans existed
+    yesterday = (datetime.now() - timedelta(days=1)).date()
+    for name in widget_names:
+        if name == "Yesterday Trimmer" and 'date' in df.columns:
+            df['date'] = pd.to_datetime(df['date'], errors='coerce')
+            df = df[df['date'].dt.date != yesterday]
+        elif name == "Column Dropper":
+            df = df.drop(columns=["email", "website"], errors='ignore')
+        elif name == "Uppercase Name Converter":
+            df['first name'] = df['first name'].str.upper()
+            df['last name'] = df['last name'].str.upper()
+        elif name == "Date Filter":
+            df['date'] = pd.to_datetime(df['date'], errors='coerce')
+            df = df[(df['date'] >= "2024-09-01") & (df['date'] <= "2024-10-12")]
+        elif name == "Row Deduplicator":
+            df = df.drop_duplicates(subset=['customer id'])
+    return df
+
+
+class PlanTests(TestCase):
+    def setUp(self):
+        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        self.df = pd.DataFrame({
+            'customer id': ['c1', 'c2', 'c1', 'c3', 'c4', 'c5'],
+            'first name': ['ann', 'Bob', 'ann', None, 'dé', 'eve'],
+            'last name': ['lee', 'ray', 'lee', 'kim', 'fox', 'ng'],
+            'email': ['a@x', 'b@x', 'a@x', 'c@x', 'd@x', 'e@x'],
+            'date': ['2024-09-01', '2024-10-12', '2024-09-15', yesterday, 'not a date', '2024-08-31'],
+        })
+
+    def plan(self, names):
+        return compile_plan([Widget.objects.create(name=name) for name in names])
+
+    def test_builtin_widgets_match_the_baseline(self):
+        names = ["Yesterday Trimmer", "Column Dropper", "Uppercase Name Converter", "Row Deduplicator", "Date Filter"]
+        for end in range(1, len(names) + 1):
+            with self.subTest(widgets=names[:end]):
+                result = self.plan(names[:end]).run(self.df.copy())
+                expected = baseline_report(names[:end], self.df.copy())
+                pd.testing.assert_frame_equal(result, expected)
+
+    def test_date_columns_are_parsed_once(self):
+        plan = self.plan(["Yesterday Trimmer", "Date Filter"])
+        self.assertEqual([step.parse_dates for step in plan.steps], [('date',), ()])
+        self.assertEqual(plan.input_date_range()[0], 'date')
+
+    def test_required_columns_leave_out_dropped_ones(self):
+        plan = self.plan(["Column Dropper", "Row Deduplicator"])
+        self.assertEqual(plan.required_columns(list(self.df.columns)), ['customer id', 'first name', 'last name', 'date'])
+
+
+class WidgetCodeTests(TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({'name': ['a', 'b'], 'qty': [1, 2]})
+        forget_widget_code(1)
+        self.addCleanup(forget_widget_code, 1)
+
+    def run_code(self, code, widget_name=None):
+        return execute_generated_code(code, self.df.copy(), widget_id=1, widget_name=widget_name)
+
+    def test_scripts_and_functions_give_the_same_result(self):
+        expected = self.df.assign(qty=[2, 4])
+        scripts = [
+            "df['qty'] = df['qty'] * 2",
+            "df = df.assign(qty=df['qty'] * 2)",
+            "def transform(df):\n    return df.assign(qty=df['qty'] * 2)",
+            "def transform(df):\n    df['qty'] *= 2",
+            "def helper(x):\n    return x * 2\ndef double(df):\n    return df.assign(qty=helper(df['qty']))",
+        ]
+        for code in scripts:
+            with self.subTest(code=code):
+                pd.testing.assert_frame_equal(self.run_code(code), expected)
+
+    def test_function_named_after_the_widget_is_preferred(self):
+        code = "def transform(df):\n    return df.head(1)\ndef qty_doubler(df):\n    return df.assign(qty=df['qty'] * 2)"
+        self.assertEqual(self.run_code(code, 'Qty Doubler')['qty'].tolist(), [2, 4])
+
+    def test_code_is_compiled_once_per_version(self):
+        code = "df = df.head(1)"
+        with mock.patch('reports.operators.compile', side_effect=compile, create=True) as compile_mock:
+            self.run_code(code)
+            self.run_code(code)
+            self.assertEqual(compile_mock.call_count, 1)
+            forget_widget_code(1)
+            self.run_code(code)
+            self.assertEqual(compile_mock.call_count, 2)
+
+    def test_failing_code_returns_none(self):
+        with self.assertLogs('reports', 'WARNING'):
+            self.assertIsNone(self.run_code("df = df['missing']"))
+
+
+class PrefixCacheTests(TestCase):
+    def setUp(self):
+        preview_cache.clear()
+        self.addCleanup(preview_cache.clear)
+        self.path = make_temp_dir(self) + '/data.csv'
+        with open(self.path, 'w') as f:
+            f.write('customer id,first name,email\nc1,ann,a@x\nc2,bob,b@x\nc1,ann,a@x\n')
+        self.dropper = Widget.objects.create(name='Column Dropper')
+        self.deduplicator = Widget.objects.create(name='Row Deduplicator')
+
+    def test_least_recently_used_entries_are_evicted(self):
+        frame = pd.DataFrame({'x': np.arange(100, dtype=np.int64)})
+        cache = PrefixCache(max_bytes=frame_nbytes(frame) * 2)
+        for key in 'abc':
+            cache.put(key, frame)
+            cache.get('a')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+        cache.put('big', pd.DataFrame({'x': np.arange(1000)}))
+        self.assertIsNone(cache.get('big'))
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+    def test_estimated_size_counts_strings(self):
+        df = pd.DataFrame({'name': [f'customer {i}' * (i % 5 + 1) for i in range(10000)], 'qty': np.arange(10000)})
+        deep = df.memory_usage(index=True, deep=True).sum()
+        self.assertAlmostEqual(frame_nbytes(df) / deep, 1, delta=0.05)
+
+    def test_preview_resumes_after_the_longest_cached_prefix(self):
+        run_preview_plan(compile_plan([self.dropper]), self.path)
+        with mock.patch.object(ColumnDropper, 'apply', autospec=True, side_effect=ColumnDropper.apply) as apply:
+            df = run_preview_plan(compile_plan([self.dropper, self.deduplicator]), self.path)
+        apply.assert_not_called()
+        self.assertEqual(df.to_dict('list'), {'customer id': ['c1', 'c2'], 'first name': ['ann', 'bob']})
+
+    def test_changed_csv_is_not_served_from_the_cache(self):
+        plan = compile_plan([self.deduplicator])
+        self.assertEqual(len(run_preview_plan(plan, self.path)), 2)
+        with open(self.path, 'a') as f:
+            f.write('c3,cy,c@x\n')
+        self.assertEqual(len(run_preview_plan(plan, self.path)), 3)
+
+
+class SandboxTests(TestCase):
+    def setUp(self):
+        self.pool = SandboxPool(size=1, cpu_seconds=1, memory_bytes=2 * 1024 ** 3, wall_seconds=5)
+        self.addCleanup(self.stop_pool)
+        self.df = pd.DataFrame({
+            'name': ['a', np.nan, 'ü', 'a'],
+            'qty': [1, 2, 3, 4],
+            'day': pd.to_datetime(['2024-01-01', None, '2024-01-03', '2024-01-04']),
+            'mixed': pd.Series([1, 'a', np.nan, 2.5], dtype=object),
+        })
+
+    def stop_pool(self):
+        while not self.pool._idle.empty():
+            self.pool._idle.get().kill()
+
+    def run_code(self, code):
+        return self.pool.run_code(code, self.df, widget_id=1, widget_name='Test')
+
+    def assert_pool_still_works(self):
+        self.assertEqual(self.run_code("df = df.head(1)")['qty'].tolist(), [1])
+        self.assertEqual(self.pool._idle.qsize(), 1)
+
+    def test_result_matches_running_in_process(self):
+        code = "df['qty'] = df['qty'] * 2\ndf['name'] = df['name'].str.upper()"
+        pd.testing.assert_frame_equal(self.run_code(code), execute_generated_code(code, self.df.copy()))
+
+    def test_segments_are_released(self):
+        before = set(os.listdir('/dev/shm'))
+        self.run_code("df = df.assign(total=df['qty'].cumsum())")
+        self.assertEqual(set(os.listdir('/dev/shm')) - before, set())
+
+    def test_errors_are_reported(self):
+        with self.assertRaisesMessage(SandboxError, "Widget Test failed to modify the CSV correctly."):
+            self.run_code("df = len(df)")
+        self.assert_pool_still_works()
+
+    def test_wall_time_limit_replaces_the_worker(self):
+        self.pool.wall_seconds = 0.5
+        with self.assertRaisesMessage(SandboxError, "did not finish within 0.5 seconds"):
+            self.run_code("import time\ntime.sleep(30)")
+        self.pool.wall_seconds = 5
+        self.assert_pool_still_works()
+
+    def test_cpu_time_limit_replaces_the_worker(self):
+        with self.assertRaisesMessage(SandboxError, "exceeding its resource limits"):
+            self.run_code("while True:\n    pass")
+        self.assert_pool_still_works()
+
+    def test_memory_limit(self):
+        with self.assertRaisesMessage(SandboxError, "Widget Test exceeded its memory limit."):
+            self.run_code("df['big'] = [np.ones(2 ** 30)] * len(df)")
+        self.assert_pool_still_works()
+
+
+class PreviewTests(TestCase):
+    def setUp(self):
+        preview_cache.clear()
+        self.addCleanup(preview_cache.clear)
+        self.csv_path = make_temp_dir(self) + '/data.csv'
+        with open(self.csv_path, 'w') as f:
+            f.write('customer id,email\n' + ''.join(f'c{i % 40},{i}@x\n' for i in range(100)))
+        self.report = Report.objects.create(user=User.objects.create_user('viewer'), title='t', csv_file=self.csv_path)
+        self.dropper = Widget.objects.create(name='Column Dropper')
+        self.deduplicator = Widget.objects.create(name='Row Deduplicator')
+
+    def preview(self, widgets, **options):
+        data = {'widgets': ','.join(str(widget.pk) for widget in widgets), **options}
+        return self.client.post(reverse('preview_csv', args=[self.report.pk]), data)
+
+    def test_head_page_of_a_row_local_chain(self):
+        response = self.preview([self.dropper], limit=3, offset=5)
+        body = response.json()
+        self.assertEqual(body['preview'], [{'customer id': 'c5'}, {'customer id': 'c6'}, {'customer id': 'c7'}])
+        self.assertIsNone(body['total_rows'])
+
+    def test_page_of_a_chain_that_needs_the_whole_file(self):
+        body = self.preview([self.deduplicator], limit=2, offset=38, format='columnar').json()
+        self.assertEqual(body['preview'], {'columns': ['customer id', 'email'], 'data': [['c38', 'c39'], ['38@x', '39@x']]})
+        self.assertEqual(body['total_rows'], 40)
+
+    def test_reservoir_sample(self):
+        first = self.preview([self.dropper], limit=10, sample='reservoir').json()
+        self.assertEqual(len(first['preview']), 10)
+        self.assertEqual(first['total_rows'], 100)
+
+        df = pd.read_csv(self.csv_path)
+        sample, total = reservoir_sample((df.iloc[start:start + 7] for start in range(0, 100, 7)), 10, seed=1)
+        self.assertEqual(total, 100)
+        self.assertEqual(len(sample), 10)
+        # Rows keep their input order and the same seed gives the same sample
+        self.assertTrue(sample.index.is_monotonic_increasing)
+        pd.testing.assert_frame_equal(sample, df.loc[sample.index])
+        pd.testing.assert_frame_equal(sample, reservoir_sample([df.iloc[:50], df.iloc[50:]], 10, seed=1)[0])
+
+    def test_head_rows_stops_reading_once_the_page_is_full(self):
+        read = []
+
+        def chunks():
+            for start in range(0, 100, 10):
+                read.append(start)
+                yield pd.DataFrame({'x': range(start, start + 10)})
+
+        self.assertEqual(head_rows(chunks(), 15, 10)['x'].tolist(), list(range(15, 25)))
+        self.assertEqual(read, [0, 10, 20])
+
+    def test_invalid_parameters_are_rejected(self):
+        for options in ({'limit': 'x'}, {'offset': -1}, {'sample': 'tail'}, {'format': 'xml'}):
+            with self.subTest(options=options):
+                self.assertEqual(self.preview([self.dropper], **options).status_code, 400)
+
+
+class WidgetCatalogTests(TestCase):
+    def setUp(self):
+        self.catalog = WidgetCatalog()
+        self.widgets = [Widget.objects.create(name=f'w{i}', code='df = df') for i in range(3)]
+        self.ids = [widget.pk for widget in self.widgets]
+
+    def test_widgets_are_loaded_in_one_query_and_kept(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.catalog.ordered(self.ids[::-1]), self.widgets[::-1])
+        with self.assertNumQueries(0):
+            self.catalog.ordered(self.ids)
+
+    def test_unknown_ids(self):
+        self.assertEqual(set(self.catalog.get_many(self.ids + [0])), set(self.ids))
+        with self.assertRaises(Widget.DoesNotExist):
+            self.catalog.ordered([self.ids[0], 0])
+
+    def test_saved_and_deleted_widgets_are_dropped(self):
+        self.catalog.get_many(self.ids)
+        widget = self.widgets[0]
+        widget.code = 'df = df.head(1)'
+        widget.save()
+        self.assertEqual(self.catalog.get_many(self.ids)[widget.pk].code, 'df = df.head(1)')
+
+        self.widgets[1].delete()
+        self.assertNotIn(self.ids[1], self.catalog.get_many(self.ids))
+
+    def test_invalidating_one_catalog_reaches_the_others(self):
+        # Another process' catalog, sharing the cache
+        other = WidgetCatalog()
+        other.get_many(self.ids)
+        Widget.objects.filter(pk=self.ids[0]).update(code='df = df.tail(1)')
+        self.assertEqual(other.get_many(self.ids)[self.ids[0]].code, 'df = df')
+
+        self.catalog.invalidate()
+        self.assertEqual(other.get_many(self.ids)[self.ids[0]].code, 'df = df.tail(1)')
+
+
+class HistoricalDataTests(TestCase):
+    def setUp(self):
+        self.path = make_temp_dir(self) + '/history.csv'
+        days = pd.date_range('2024-01-25', '2024-03-10', freq='D')
+        self.expected = pd.DataFrame({'date': days, 'value': np.arange(len(days)) * 1.5})
+        with open(self.path, 'w') as f:
+            f.write('date,value,note\n')
+            f.write(''.join(f'{day:%d/%m/%Y},{value},x\n' for day, value in zip(days, self.expected['value'])))
+            f.write('not a date,1,x\n31/01/2024,n/a,x\n')
+
+    def test_csv_is_loaded_skipping_bad_rows(self):
+        self.assertEqual(load_historical_csv(self.path), (len(self.expected), 2))
+        self.assertEqual(load_historical_csv(self.path, replace=True), (len(self.expected), 2))
+        self.assertEqual(HistoricalData.objects.count(), len(self.expected))
+
+    def test_aggregates_match_pandas(self):
+        load_historical_csv(self.path)
+        for period, frequency in (('week', 'W-SUN'), ('month', 'MS')):
+            for aggregate in ('sum', 'avg', 'max'):
+                with self.subTest(period=period, aggregate=aggregate):
+                    rows = pd.DataFrame(HistoricalData.objects.aggregate_by(period, aggregate))
+                    grouped = self.expected.resample(frequency, on='date', label='left' if period == 'month' else 'right')
+                    expected = grouped['value'].agg('mean' if aggregate == 'avg' else aggregate)
+                    starts = expected.index - pd.Timedelta(days=6) if period == 'week' else expected.index
+                    self.assertEqual([pd.Timestamp(day) for day in rows['date']], list(starts))
+                    np.testing.assert_allclose(rows['value'], expected.to_numpy())
+                    self.assertEqual(rows['count'].tolist(), grouped.size().tolist())
+
+    def test_between_and_unknown_periods(self):
+        load_historical_csv(self.path)
+        rows = list(HistoricalData.objects.between('2024-02-01', '2024-02-29').aggregate_by('month', 'count'))
+        self.assertEqual([(row['date'].isoformat(), row['value']) for row in rows], [('2024-02-01', 29)])
+        with self.assertRaises(ValueError):
+            HistoricalData.objects.aggregate_by('year')
+
+
+@override_settings(REPORTS_JOB_BACKEND='sync', REPORTS_SANDBOX_WORKERS=0)
+class AsyncViewTests(TransactionTestCase):
+    # Committed rows, so the pipeline threads can see them
+    def setUp(self):
+        directory = make_temp_dir(self)
+        patcher = mock.patch.object(artifact_store, 'root', directory + '/artifacts')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        preview_cache.clear()
+        self.addCleanup(preview_cache.clear)
+
+        csv_path = directory + '/data.csv'
+        with open(csv_path, 'w') as f:
+            f.write('customer id,amount\nc1,1.5\nc2,2\nc1,3\n')
+        self.user = User.objects.create_user('async')
+        self.report = Report.objects.create(user=self.user, title='sales', csv_file=csv_path)
+        self.report.widgets.set([Widget.objects.create(name='Row Deduplicator')])
+        self.factory = RequestFactory()
+        self.async_factory = AsyncRequestFactory()
+
+    async def test_preview_matches_the_sync_view(self):
+        data = {'widgets': str(await self.report.widgets.values_list('id', flat=True).aget()), 'limit': 1, 'offset': 1}
+        response = await async_views.preview_csv(self.async_factory.post('/', data), self.report.pk)
+        expected = await sync_to_async(views.preview_csv)(self.factory.post('/', data), self.report.pk)
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(json.loads(response.content)['preview'], [{'customer id': 'c2', 'amount': 2.0}])
+
+    async def test_download_streams_and_revalidates(self):
+        response = await async_views.download_csv_report(self.async_factory.get('/'), self.report.pk)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content, b'customer id,amount\nc1,1.5\nc2,2.0\n')
+
+        request = self.async_factory.get('/', headers={'if-none-match': response['ETag']})
+        self.assertEqual((await async_views.download_csv_report(request, self.report.pk)).status_code, 304)
+
+    async def test_regenerate_runs_the_job(self):
+        request = self.async_factory.post('/')
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        response = await async_views.regenerate_report(request, self.report.pk)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(json.loads(response.content)['status'], ReportJob.DONE)
+
+    async def test_event_loop_keeps_serving_during_a_slow_preview(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_page(*args):
+            started.set()
+            release.wait(5)
+            return {'error': 'slow'}
+
+        with mock.patch.object(async_views, 'preview_plan_page', slow_page):
+            preview = asyncio.ensure_future(async_views.preview_csv(self.async_factory.post('/', {}), self.report.pk))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            # The page is being computed in the pipeline pool, the loop still answers other requests
+            response = await async_views.preview_csv(self.async_factory.get('/'), self.report.pk)
+            self.assertEqual(response.status_code, 405)
+            self.assertFalse(preview.done())
+            release.set()
+            self.assertEqual(json.loads((await preview).content), {'preview': {'error': 'slow'}})
+
+
+class AppendStoreTests(TestCase):
+    def setUp(self):
+        self.directory = make_temp_dir(self)
+        self.store = AppendStore(self.directory + '/store')
+        self.feed = self.directory + '/feed.csv'
+        self.plan = compile_plan([Widget.objects.create(name='Row Deduplicator')])
+
+    def write(self, text, mode='a'):
+        with open(self.feed, mode) as f:
+            f.write(text)
+
+    def result(self, state):
+        return b''.join(self.store.read(1, self.plan, state)).decode()
+
+    def full_run(self):
+        return self.plan.run(pd.read_csv(self.feed)).to_csv(index=False)
+
+    def test_appended_rows_are_deduplicated_against_earlier_increments(self):
+        self.write('customer id,amount\nc1,1\nc2,2\nc1,3\n', 'w')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(state['result_rows'], 2)
+
+        self.write('c2,4\nc3,5\nc3,6\n')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual((state['rows'], state['result_rows']), (6, 3))
+        self.assertEqual(self.result(state), self.full_run())
+
+    def test_incomplete_last_line_waits_for_the_next_refresh(self):
+        self.write('customer id,amount\nc1,1\nc2', 'w')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(state['rows'], 1)
+
+        self.write(',2\n')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(self.result(state), self.full_run())
+
+    def test_changed_prefix_is_processed_from_the_start(self):
+        self.write('customer id,amount\nc1,1\nc2,2\n', 'w')
+        self.store.refresh(1, self.plan, self.feed)
+
+        self.write('customer id,amount\nc9,1\nc2,2\nc3,3\n', 'w')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(state['rows'], 3)
+        self.assertEqual(self.result(state), self.full_run())
+
+    def test_appended_values_that_dont_fit_the_schema_are_kept_exact(self):
+        # The first rows narrow amount to float32 and qty to uint8
+        self.write('customer id,amount,qty\n' + ''.join(f'c{i},{i * 0.5},{i}\n' for i in range(1, 101)), 'w')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(state['schema']['dtypes']['amount'], 'float32')
+        self.assertEqual(state['schema']['dtypes']['qty'], 'uint8')
+
+        self.write('c500,1.123456789,300\nc501,2.5,-1\nc1,0.5,1\n')
+        state = self.store.refresh(1, self.plan, self.feed)
+        result = self.result(state)
+        self.assertIn('c500,1.123456789,300\n', result)
+        self.assertIn('c501,2.5,-1\n', result)
+        self.assertEqual(result, self.full_run())
+
+        # Later increments keep using the widened schema
+        self.write('c502,0.1,70000\nc500,1.123456789,300\n')
+        state = self.store.refresh(1, self.plan, self.feed)
+        self.assertEqual(state['rows'], 105)
+        self.assertEqual(self.result(state), self.full_run())
+
+
+class SchemaTests(TestCase):
+    def setUp(self):
+        self.schema = infer_schema(pd.DataFrame({'qty': [1, 100], 'amount': [0.5, 1.5], 'name': ['a', 'a']}))
+
+    def test_infers_compact_dtypes(self):
+        self.assertEqual(self.schema['dtypes'], {'qty': 'uint8', 'amount': 'float32', 'name': 'category'})
+
+    def test_casts_values_that_fit(self):
+        df = apply_schema(pd.DataFrame({'qty': [3, 4], 'amount': [0.25, 2.0], 'name': ['b', 'a']}), self.schema)
+        self.assertEqual(df['qty'].dtype, np.uint8)
+        self.assertEqual(df['amount'].dtype, np.float32)
+        self.assertIsInstance(df['name'].dtype, pd.CategoricalDtype)
+
+    def test_keeps_values_that_dont_fit(self):
+        df = apply_schema(pd.DataFrame({'qty': [300, -1], 'amount': [1.123456789, 2.0]}), self.schema)
+        self.assertEqual(df['qty'].tolist(), [300, -1])
+        self.assertEqual(df['amount'].tolist(), [1.123456789, 2.0])
+
+    def test_keeps_text_in_numeric_columns(self):
+        df = apply_schema(pd.DataFrame({'qty': ['x', '2']}), self.schema)
+        self.assertEqual(df['qty'].tolist(), ['x', '2'])
+
+
+class DateTests(TestCase):
+    def test_unambiguous_values_decide_the_format(self):
+        values = pd.Series([f'{day:%d/%m/%Y}' for day in pd.date_range('2024-01-25', periods=20)])
+        self.assertEqual(detect_date_format(values), '%d/%m/%Y')
+        self.assertEqual(parse_dates(values).dt.month.tolist(), [1] * 7 + [2] * 13)
+
+
+class ColumnarSidecarTests(TestCase):
+    def setUp(self):
+        self.path = make_temp_dir(self) + '/data.csv'
+        with open(self.path, 'w') as f:
+            f.write('Name,Qty\na,1\nb,2\n')
+
+    def test_reads_go_through_the_sidecar(self):
+        build_columnar_cache(self.path)
+        self.assertTrue(os.path.isdir(sidecar_path(self.path)))
+        self.assertEqual(read_report_csv(self.path).to_dict('list'), {'name': ['a', 'b'], 'qty': [1, 2]})
+
+    def test_sidecar_of_a_changed_file_is_ignored(self):
+        build_columnar_cache(self.path)
+        with open(self.path, 'w') as f:
+            f.write('Name,Qty\nc,3\nd,4\ne,5\n')
+        self.assertIsNone(open_sidecar(self.path))
+        self.assertEqual(read_report_csv(self.path)['name'].tolist(), ['c', 'd', 'e'])
+
+    def test_text_columns_read_back_in_chunks(self):
+        values = ['b', 'a', None, 'ü€', '', 'a', 'b']
+        df = pd.DataFrame({
+            'text': pd.Series(values, dtype=object),
+            'category': pd.Series(values, dtype='category'),
+            'string': pd.Series(values, dtype='string[python]'),
+            'mixed': pd.Series([1, 'a', None, 2.5, 'a', 1, 'b'], dtype=object),
+        })
+        write_sidecar(self.path, df)
+        columnar = open_sidecar(self.path)
+
+        chunks = list(columnar.iter_chunks(3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+        pd.testing.assert_frame_equal(pd.concat(chunks), df)
+        pd.testing.assert_frame_equal(columnar.read(rows=np.array([3, 0])), df.iloc[[3, 0]])
+
+
+class EncoderTests(TestCase):
+    def test_columnar_preview_matches_records(self):
+        df = pd.DataFrame({
+            'amount': [1 / 3, 2.0 ** 60, 1.123456789012345678, np.nan],
+            'ratio': np.array([0.1, 1 / 3, 5, np.nan], dtype=np.float32),
+            'mixed': pd.Series([1, 1 / 3, None, 2.5], dtype=object),
+            'qty': [1, 2, 3, 2 ** 62],
+            'name': ['a', None, 'ü', 'c'],
+            'day': pd.to_datetime(['2024-01-02', None, '2024-03-04', '2024-05-06']),
+        })
+        encoded = json.loads(encode_columnar(df))
+        records = [dict(zip(encoded['columns'], row)) for row in zip(*encoded['data'])]
+
+        expected = [
+            {column: None if pd.isna(value) else value for column, value in record.items()}
+            for record in frame_to_records(df)
+        ]
+        self.assertEqual(records, expected)
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        directory = make_temp_dir(self)
+        patcher = mock.patch.object(artifact_store, 'root', directory + '/artifacts')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.csv_path = directory + '/data.csv'
+        with open(self.csv_path, 'w') as f:
+            f.write('customer id,amount\nc1,1\nc2,2\nc1,3\n')
+        self.user = User.objects.create_user('downloader')
+        self.report = Report.objects.create(user=self.user, title='sales', csv_file=self.csv_path)
+        self.report.widgets.set([Widget.objects.create(name='Row Deduplicator')])
+        self.client.force_login(self.user)
+        self.url = reverse('download_csv', args=[self.report.pk])
+
+    def test_download_streams_the_report(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'customer id,amount\nc1,1\nc2,2\n')
+
+    def test_unchanged_report_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_changed_csv_gets_a_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with open(self.csv_path, 'a') as f:
+            f.write('c3,4\n')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_gzip_download_has_its_own_etag(self):
+        plain = self.client.get(self.url)
+        compressed = self.client.get(self.url, {'compress': 'gzip'})
+        self.assertNotEqual(plain['ETag'], compressed['ETag'])
+        self.assertEqual(gzip.decompress(b''.join(compressed.streaming_content)), b''.join(plain.streaming_content))
+
+
+class StorageTests(TestCase):
+    def setUp(self):
+        directory = make_temp_dir(self)
+        self.storage = ContentAddressedStorage(directory + '/uploads')
+        self.source = directory + '/source.csv'
+        with open(self.source, 'w') as f:
+            f.write('a,b\n1,2\n')
+        self.user = User.objects.create_user('uploader')
+
+    def test_identical_content_is_stored_once(self):
+        self.assertEqual(self.storage.save_path(self.source), self.storage.save_path(self.source))
+
+    def test_release_keeps_referenced_files(self):
+        path = self.storage.save_path(self.source)
+        report = Report.objects.create(user=self.user, title='kept', csv_file=path)
+        self.assertFalse(self.storage.release(path))
+        self.assertTrue(os.path.exists(path))
+
+        report.delete()
+        self.assertTrue(self.storage.release(path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_release_ignores_files_outside_the_store(self):
+        self.assertFalse(self.storage.release(self.source))
+        self.assertTrue(os.path.exists(self.source))
+
+
+class UploadTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(upload_storage, 'location', make_temp_dir(self))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(User.objects.create_user('uploader'))
+
+    def test_upload_is_profiled_while_received(self):
+        data = 'Name;Qty\nä;1\nb;2\nc;3\n'.encode()
+        response = self.client.post(reverse('upload_csv'), {'csv_file': SimpleUploadedFile('data.csv', data, 'text/csv')})
+        profile = response.context['profile']
+        self.assertEqual(profile['rows'], 3)
+        self.assertEqual(profile['delimiter'], ';')
+        self.assertEqual(profile['encoding'], 'utf-8')
+        self.assertEqual(profile['header'], ['Name', 'Qty'])
+        self.assertEqual(profile['head_rows'][0], ['ä', '1'])
+        # Nothing references the file, so nothing is kept
+        self.assertEqual([name for _, _, names in os.walk(upload_storage.location) for name in names], [])
+
+
+class ForecastTests(TestCase):
+    def test_linear_series_are_extrapolated_per_key(self):
+        dates = pd.date_range('2024-01-01', periods=10).strftime('%Y-%m-%d').tolist()
+        df = pd.DataFrame({
+            'store': ['a'] * 10 + ['b'] * 10,
+            'date': dates * 2,
+            'value': [2.0 * i for i in range(10)] + [5.0] * 10,
+        })
+        keys, future, predictions = forecast_series(df, key='store', horizon=2)
+        self.assertEqual(list(keys), ['a', 'b'])
+        self.assertEqual(str(future[0, 0]), '2024-01-11')
+        np.testing.assert_allclose(predictions, [[20.0, 22.0], [5.0, 5.0]])
+
+
+class SaveReportDataTests(TestCase):
+    def test_only_the_data_is_written(self):
+        user = User.objects.create_user('owner')
+        report = Report.objects.create(user=user, title='old', csv_file='/tmp/old.csv')
+        stale = Report.objects.get(pk=report.pk)
+        # Edited while a job holding `stale` runs
+        Report.objects.filter(pk=report.pk).update(title='new', csv_file='/tmp/new.csv', incremental=True)
+
+        save_report_data(user, [Widget.objects.create(name='Row Deduplicator', description='dedupe')], stale)
+        report.refresh_from_db()
+        self.assertEqual((report.title, report.csv_file.name, report.incremental), ('new', '/tmp/new.csv', True))
+        self.assertEqual(report.data, {'Row Deduplicator': 'dedupe'})
+
+
+@override_settings(REPORTS_JOB_BACKEND='orm', REPORTS_SANDBOX_WORKERS=0, REPORTS_JOB_STALE_SECONDS=60)
+class ReportJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.csv_path = make_temp_dir(self) + '/data.csv'
+        with open(self.csv_path, 'w') as f:
+            f.write('customer id,amount\nc1,1\n')
+        self.report = Report.objects.create(user=self.user, title='sales', csv_file=self.csv_path)
+
+    def make_job(self, widgets, **fields):
+        return ReportJob.objects.create(
+            report=self.report, user=self.user, widget_ids=[widget.pk for widget in widgets], **fields
+        )
+
+    def test_stale_running_job_is_requeued(self):
+        stale = timezone.now() - timezone.timedelta(minutes=5)
+        job = self.make_job([], status=ReportJob.RUNNING, started_at=stale, heartbeat_at=stale, attempts=1)
+        live = self.make_job([], status=ReportJob.RUNNING, started_at=stale, heartbeat_at=timezone.now(), attempts=1)
+        with self.assertLogs('reports.jobs', 'WARNING'):
+            recover_jobs(force=True)
+        job.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((job.status, job.heartbeat_at), (ReportJob.QUEUED, None))
+        self.assertEqual(live.status, ReportJob.RUNNING)
+        self.assertTrue(claim_job(job.pk))
+
+    def test_job_that_keeps_losing_its_worker_fails(self):
+        stale = timezone.now() - timezone.timedelta(minutes=5)
+        job = self.make_job([], status=ReportJob.RUNNING, started_at=stale, heartbeat_at=stale, attempts=2)
+        with self.assertLogs('reports.jobs', 'WARNING'):
+            recover_jobs(force=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (ReportJob.FAILED, INTERRUPTED_MESSAGE))
+
+    def test_widget_errors_are_shown_without_a_traceback(self):
+        widget = Widget.objects.create(name='Broken', code="raise ValueError('boom')")
+        job = self.make_job([widget])
+        self.assertTrue(claim_job(job.pk))
+        with self.assertLogs('reports', 'WARNING'):
+            execute_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertEqual(job.error, 'Widget Broken failed to modify the CSV correctly.')
+
+    def test_internal_errors_get_a_generic_message(self):
+        os.unlink(self.csv_path)
+        job = self.make_job([Widget.objects.create(name='Row Deduplicator')])
+        self.assertTrue(claim_job(job.pk))
+        with self.assertLogs('reports.jobs', 'ERROR'):
+            execute_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.error, FAILED_MESSAGE)
@@ -0,0 +1,169 @@
+import codecs
+import csv
+import hashlib
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+
+# Uploaded CSVs are written straight into the upload store's directory by
+# CSVUploadHandler, which profiles them in the same pass:
+#   - the SHA-256 of the content, so storing them is a rename (see
+#     ContentAddressedStorage.save_upload) instead of another read
+#   - the number of rows, counted as lines after the header, so a quoted
+#     value spanning lines counts once per line
+#   - the encoding: UTF-8 (with or without BOM) when every byte decodes as
+#     such, UTF-16 when there is a UTF-16 BOM, Latin-1 otherwise
+#   - the delimiter, sniffed from the first lines
+#   - the header and first REPORTS_UPLOAD_PREVIEW_ROWS rows
+# so nothing has to parse the file again to tell what was uploaded.
+
+HEAD_MAX_BYTES = 1024 * 1024
+DELIMITERS = ',;\t|'
+CSV_CONTENT_TYPES = ('text/csv', 'application/csv', 'application/vnd.ms-excel')
+
+
+class ProfiledUploadedFile(UploadedFile):
+    """
+    A CSV received by CSVUploadHandler: a temporary file in the upload store
+    with its `sha256` and `profile` (rows, encoding, delimiter, header and
+    head_rows). The temporary file is removed on close unless it was stored.
+    """
+
+    def __init__(self, file, name, content_type, size, charset, content_type_extra, sha256, profile):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+        self.profile = profile
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            if os.path.exists(self.file.name):
+                os.unlink(self.file.name)
+
+
+def _detect_bom(head):
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def sniff_delimiter(text):
+    try:
+        return csv.Sniffer().sniff(text, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return ','
+
+
+def parse_head(head, encoding, complete, n_rows):
+    """Return (delimiter, header, rows) of the first bytes of a CSV, `complete` when they are the whole file."""
+    text = head.decode(encoding, errors='replace')
+    if not complete:
+        # The last line was cut short by HEAD_MAX_BYTES or the row limit
+        text = text[:text.rfind('\n') + 1]
+    delimiter = sniff_delimiter(text)
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+    header = next(reader, [])
+    rows = []
+    for row in reader:
+        if len(rows) == n_rows:
+            break
+        if row:
+            rows.append(row)
+    return delimiter, header, rows
+
+
+class CSVUploadHandler(FileUploadHandler):
+    """
+    Receive uploaded CSVs into the upload store as ProfiledUploadedFiles.
+    Other files are left to the next handlers.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.n_rows = settings.REPORTS_UPLOAD_PREVIEW_ROWS
+        self.active = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.active = self.file_name.lower().endswith('.csv') or self.content_type in CSV_CONTENT_TYPES
+        if not self.active:
+            return
+
+        from .storage import upload_storage
+        os.makedirs(upload_storage.location, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=upload_storage.location, suffix='.tmp', delete=False)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.newlines = 0
+        self.tail = b''
+        self.head = bytearray()
+        self.head_done = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.utf8 = True
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.file.write(raw_data)
+        self.digest.update(raw_data)
+        self.size += len(raw_data)
+        self.newlines += raw_data.count(b'\n')
+        self.tail = (self.tail + raw_data)[-2:]
+
+        if not self.head_done:
+            self.head += raw_data
+            # Enough for the header and the rows shown, give or take quoted line breaks
+            self.head_done = len(self.head) >= HEAD_MAX_BYTES or self.head.count(b'\n') > self.n_rows + 1
+        if self.utf8 and not (raw_data.isascii() and not self.decoder.getstate()[0]):
+            try:
+                self.decoder.decode(raw_data)
+            except UnicodeDecodeError:
+                self.utf8 = False
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.file.flush()
+        self.file.seek(0)
+
+        if self.utf8:
+            try:
+                self.decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self.utf8 = False
+        head = bytes(self.head[:HEAD_MAX_BYTES])
+        encoding = _detect_bom(head) or ('utf-8' if self.utf8 else 'latin-1')
+        delimiter, header, head_rows = parse_head(head, encoding, len(head) == self.size, self.n_rows)
+
+        # A last line without a line break still counts (b'\n\x00' ends UTF-16 little endian lines)
+        ends_with_newline = self.tail.endswith(b'\n') or self.tail == b'\n\x00'
+        lines = self.newlines + (1 if self.size and not ends_with_newline else 0)
+        profile = {
+            'rows': max(lines - 1, 0),
+            'encoding': encoding,
+            'delimiter': delimiter,
+            'header': header,
+            'head_rows': head_rows,
+        }
+        return ProfiledUploadedFile(
+            self.file, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra,
+            self.digest.hexdigest(), profile,
+        )
+
+    def upload_interrupted(self):
+        if self.active and hasattr(self, 'file'):
+            self.file.close()
+            if os.path.exists(self.file.name):
+                os.unlink(self.file.name)
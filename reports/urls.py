@@ -1,13 +1,22 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Views that run the report pipeline, async ones for ASGI deployments
+if settings.REPORTS_ASYNC_VIEWS:
+    from . import async_views as pipeline_views
+else:
+    pipeline_views = views
+
 urlpatterns = [
     path('', views.report_list, name='report_list'),  # For listing all reports
     path('create/', views.create_report_view, name='create_report'),
     path('<int:report_id>/', views.report_detail, name='report_detail'),
     path('<int:report_id>/edit/', views.edit_report, name='edit_report'),  # Ensure the argument matches
     path('<int:report_id>/delete/', views.delete_report, name='delete_report'),
-    path('<int:report_id>/preview/', views.preview_csv, name='preview_csv'),  # Add the preview URL here
-    path('<int:report_id>/download/', views.download_csv_report, name='download_csv'),  # Add the download CSV URL
+    path('<int:report_id>/preview/', pipeline_views.preview_csv, name='preview_csv'),  # Add the preview URL here
+    path('<int:report_id>/download/', pipeline_views.download_csv_report, name='download_csv'),  # Add the download CSV URL
+    path('<int:report_id>/status/', views.report_status, name='report_status'),  # Progress of the latest generation job
+    path('<int:report_id>/regenerate/', pipeline_views.regenerate_report, name='regenerate_report'),
     path('upload_csv/', views.upload_csv, name='upload_csv'),
 ]
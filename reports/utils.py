@@ -1,283 +1,394 @@
+import logging
 import os
+import zlib
 from django.conf import settings
+from django.db.models.fields.files import FieldFile
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
-from widgets.models import Widget
 from .models import Report, HistoricalData
-
-
-def execute_generated_code(generated_code, df):
-    # Sandbox setup: Create a local environment for executing the code
-    local_env = {'df': df, 'pd': pd, 'np': np}
-    
+from .appends import append_store
+from .artifacts import artifact_store
+from .cache import file_fingerprint, preview_cache
+from .catalog import widget_catalog
+from .checkpoints import checkpoint_store
+from .columnar import open_sidecar, write_sidecar
+from .forecast import forecast_series
+from .operators import OperatorError, combine_step_stats, compile_plan, execute_generated_code
+from .schema import apply_schema, infer_schema, load_schema, plain_dtypes, save_schema
+
+
+logger = logging.getLogger(__name__)
+
+def get_csv_path(csv_file):
+    # Report.csv_file is a FieldFile holding the absolute path the upload was saved to,
+    # callers may also pass a plain path
+    if isinstance(csv_file, FieldFile):
+        return csv_file.name if os.path.isabs(csv_file.name) else csv_file.path
+    return csv_file
+
+
+def read_report_csv(csv_file_path, columns=None):
+    """
+    Load an uploaded CSV with normalized column names and the compact dtypes
+    of its schema, optionally keeping only `columns`. Reads go through the
+    memory-mapped columnar sidecar, which is built from the text CSV the
+    first time it is missing.
+    """
+    csv_file_path = get_csv_path(csv_file_path)
+    columnar = open_sidecar(csv_file_path)
+    if columnar is not None:
+        return columnar.read(columns)
+
+    df = build_columnar_cache(csv_file_path)
+    if columns is not None:
+        df = df[[column for column in df.columns if column in columns]]
+    return df
+
+
+def read_report_columns(csv_file_path):
+    csv_file_path = get_csv_path(csv_file_path)
+    columnar = open_sidecar(csv_file_path)
+    if columnar is not None:
+        return list(columnar.columns)
+    return list(pd.read_csv(csv_file_path, nrows=0).columns.str.lower())
+
+
+def read_report_csv_chunks(csv_file_path, chunksize=None, columns=None):
+    chunksize = chunksize or settings.REPORTS_CHUNK_ROWS
+    csv_file_path = get_csv_path(csv_file_path)
+    columnar = open_sidecar(csv_file_path)
+    if columnar is not None:
+        yield from columnar.iter_chunks(chunksize, columns)
+        return
+
+    schema = load_schema(csv_file_path)
+    usecols = None if columns is None else (lambda column: column.lower() in columns)
+    with pd.read_csv(csv_file_path, chunksize=chunksize, usecols=usecols) as reader:
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.lower()
+            yield apply_schema(chunk, schema) if schema is not None else chunk
+
+
+def build_columnar_cache(csv_file_path):
+    """
+    Parse an uploaded CSV once, infer its schema and store both next to the
+    file, the data as a columnar sidecar. Returns the parsed DataFrame.
+    """
+    csv_file_path = get_csv_path(csv_file_path)
+    df = pd.read_csv(csv_file_path)
+    df.columns = df.columns.str.lower()  # Normalize column names
+
+    schema = load_schema(csv_file_path) or infer_schema(df)
+    df = apply_schema(df, schema)
     try:
-        print(f"Generated code:\n{generated_code}")  # Debug: Log the generated code
-        
-        # Execute the generated code, making sure we pass it the correct context
-        exec(generated_code, {}, local_env)
-        
-        # We expect the function to have modified the DataFrame in place.
-        if 'df' in local_env:
-            return local_env['df']
-        else:
-            raise ValueError("Generated code did not return or modify the DataFrame as expected.")
-    except Exception as e:
-        print(f"Error executing generated code: {str(e)}")
-        return None
-
-
-
-def generate_report(user, widget_ids, csv_file_path=None, report=None):
-    print(f'Generating report for user: {user} with widgets: {widget_ids}')
-    report_data = {}
-    final_df = None  # Store the final DataFrame after all widgets
-
-    # Sort the widgets based on the order they were passed in
-    widgets_qs = Widget.objects.filter(id__in=widget_ids)
-    ordered_widgets = [widgets_qs.get(id=widget_id) for widget_id in widget_ids]
-
-    # Track whether the Yesterday Trimmer needs to be applied
-    apply_yesterday_trimmer = False
-
-    # Fetch and add widget data based on the order of widget execution
-    for widget in ordered_widgets:
-        report_data[widget.name] = widget.description
-
-        # Check if we need to apply the Yesterday Trimmer logic
-        if widget.name == "Yesterday Trimmer":
-            apply_yesterday_trimmer = True
-
-    # Process CSV if provided
-    if csv_file_path:
-        df = pd.read_csv(csv_file_path)
-        df.columns = df.columns.str.lower()  # Normalize column names
-        print("Normalized column names:\n", df.columns)  # Debugging
-
-        # Apply widgets in order
-        for widget in ordered_widgets:
-            if widget.name == "Yesterday Trimmer" and 'date' in df.columns:
-                print("Applying Yesterday Trimmer...")
-                df['date'] = pd.to_datetime(df['date'], errors='coerce')
-                yesterday_date = (datetime.now() - timedelta(days=1)).date()
-                df = df[df['date'].dt.date != yesterday_date]
-                print("Trimmed DataFrame:\n", df.head())
-
-            elif widget.name == "Column Dropper":
-                columns_to_drop = ["email", "website"]
-                print(f"Dropping columns: {columns_to_drop}")
-                df = df.drop(columns=columns_to_drop, errors='ignore')
-                print("DataFrame after Column Dropper:\n", df.head())
-
-            elif widget.name == "Uppercase Name Converter":
-                df['first name'] = df['first name'].str.upper()
-                df['last name'] = df['last name'].str.upper()
-                print("DataFrame after Uppercase Name Converter:\n", df.head())
-
-            elif widget.name == "Date Filter":
-                start_date = "2024-09-01"
-                end_date = "2024-10-12"
-                df['date'] = pd.to_datetime(df['date'], errors='coerce')
-                df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-                print("DataFrame after Date Filter:\n", df.head())
-
-            elif widget.name == "Row Deduplicator":
-                df = df.drop_duplicates(subset=['customer id'])
-                print("DataFrame after Row Deduplicator:\n", df.head())
-
-            # Capture the final DataFrame after all widgets have been applied
-            final_df = df
+        save_schema(csv_file_path, schema)
+        write_sidecar(csv_file_path, df, schema['dates'])
+    except OSError as e:
+        logger.warning("Could not write columnar cache for %s: %s", csv_file_path, e)
+    return df
+
+
+def ensure_columnar_cache(csv_file_path):
+    # Identical uploads share a path, so their sidecar may already exist
+    if open_sidecar(get_csv_path(csv_file_path)) is None:
+        build_columnar_cache(csv_file_path)
+
+
+def plan_read_options(plan, columnar):
+    """
+    Arguments for ColumnarFile.read()/iter_chunks() that load only what `plan`
+    needs: the columns it reads or keeps, date columns already parsed, and
+    only the rows of a leading date range filter, looked up in the file's
+    sorted date index.
+    """
+    rows = None
+    date_range = plan.input_date_range()
+    if date_range is not None and date_range[0] in columnar.columns:
+        column, start, end = date_range
+        rows = columnar.date_index(column).positions_between(start, end)
+    return {
+        'columns': plan.required_columns(columnar.columns),
+        'rows': rows,
+        'dates': plan.input_date_columns(),
+    }
+
+
+def read_plan_input(plan, csv_file_path):
+    csv_file_path = get_csv_path(csv_file_path)
+    columnar = open_sidecar(csv_file_path)
+    if columnar is not None:
+        return columnar.read(**plan_read_options(plan, columnar))
+    # Only load the columns the plan reads or keeps
+    return read_report_csv(csv_file_path, plan.required_columns(read_report_columns(csv_file_path)))
+
+
+def run_plan_checkpointed(plan, csv_file_path, on_step=None, stats=None):
+    """
+    Run `plan` over the CSV, resuming after the longest prefix of its steps
+    that an earlier run checkpointed and checkpointing every step it runs.
+    Stats are only collected for the steps that actually ran.
+    """
+    csv_file_path = get_csv_path(csv_file_path)
+    columnar = open_sidecar(csv_file_path)
+    options = plan_read_options(plan, columnar) if columnar is not None else None
+
+    # Steps before a date range applied while reading, or before the step parsing a
+    # column that was parsed while reading, see different input, so how the input
+    # was read is part of every key
+    read_signature = None
+    if options is not None:
+        date_range = plan.input_date_range() if options['rows'] is not None else None
+        read_signature = [date_range, sorted(options['dates'])]
+    base = [file_fingerprint(csv_file_path), read_signature]
+    signatures = plan.signatures()
+
+    start, df = checkpoint_store.longest_prefix(base, signatures)
+    if df is None:
+        df = columnar.read(**options) if columnar is not None else read_plan_input(plan, csv_file_path)
+    logger.debug("Resuming %s after %s checkpointed step(s)", csv_file_path, start)
+    if start and on_step is not None:
+        on_step(start - 1, df)  # Report the reused steps as done
+
+    def checkpoint_step(index, step_df):
+        checkpoint_store.save(checkpoint_store.make_key(base, signatures[:index + 1]), step_df)
+        if on_step is not None:
+            on_step(index, step_df)
+
+    return plan.run(df, start=start, on_step=checkpoint_step, stats=stats)
+
+
+def get_ordered_widgets(widget_ids):
+    # Widgets in the order they were passed in, from the process-wide catalog
+    return widget_catalog.ordered(list(widget_ids))
+
+
+def save_report_data(user, ordered_widgets, report=None):
+    report_data = {widget.name: widget.description for widget in ordered_widgets}
 
     # Save report data to existing report or create a new one
     if report:
         report.data = report_data
-        report.save()
-        print('Existing report updated with new data.')
+        # Only the data column: jobs run after the request, and the report may have been edited since they loaded it
+        Report.objects.filter(pk=report.pk).update(data=report_data)
+        logger.debug('Existing report %s updated with new data.', report.pk)
     else:
         report = Report.objects.create(user=user, title="Generated Report", data=report_data)
-        print('New report created.')
-
-    # Return the final modified DataFrame for further use (like CSV download)
-    return final_df
-
-
-def generate_report_preview(widget_ids, csv_file_path):
-    report_data = {}
-
-    print(f"Widget IDs for preview: {widget_ids}")
-    print(f"CSV file path for preview: {csv_file_path}")
-
-    if csv_file_path:
-        try:
-            df = pd.read_csv(csv_file_path)
-            print("CSV loaded successfully.")
-            print("Initial DataFrame:\n", df.head())  # Debugging: Check the first few rows of the loaded CSV
-
-            df.columns = df.columns.str.lower()
-            print("Normalized column names:\n", df.columns)  # Debugging: Check if columns are normalized correctly
-        except Exception as e:
-            print(f"Error loading CSV file: {e}")
-            return {"error": "Error loading CSV"}
-
-        widgets_qs = Widget.objects.filter(id__in=widget_ids)
-        ordered_widgets = [widgets_qs.get(id=widget_id) for widget_id in widget_ids]
-        print(f"Ordered widgets: {[widget.name for widget in ordered_widgets]}")  # Debugging: Check the widget names in order
-
-        # Apply widgets in order up to the selected point
-        for widget in ordered_widgets:
-            print(f"Applying widget: {widget.name}")
-
-            if widget.name == "Yesterday Trimmer":
-                print("Applying Yesterday Trimmer logic")
-                try:
-                    if 'date' in df.columns:
-                        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-                        print(f"Parsed 'date' column:\n", df['date'])
-
-                        yesterday = datetime.now() - timedelta(days=1)
-                        yesterday_date = yesterday.date()
-                        print("Yesterday's date:", yesterday_date)
-
-                        df_before_trimming = df.copy()
-                        df = df[df['date'].dt.date != yesterday_date]
-                        print(f"DataFrame after trimming:\n", df.head())
-
-                        if df.equals(df_before_trimming):
-                            print("No rows removed. Check if date filtering is working properly.")
-                    else:
-                        print("No 'date' column found in the DataFrame.")
-                except Exception as e:
-                    print(f"Error applying Yesterday Trimmer: {e}")
-                    return {"error": "Error applying Yesterday Trimmer"}
-
-            elif widget.name == "Column Dropper":
-                try:
-                    # Hardcode the columns to drop for now
-                    columns_to_drop = ["email", "website"]  # Adjust based on your use case
-                    print(f"Applying Column Dropper with columns to drop: {columns_to_drop}")
-
-                    # Manually apply the logic in Python here
-                    df = df.drop(columns=columns_to_drop, axis=1, errors='ignore')  # Drop the specified columns
-                    print(f"DataFrame after applying {widget.name}:\n", df.head())  # Debugging: Check the DataFrame after applying the widget
-                except Exception as e:
-                    print(f"Error applying {widget.name}: {e}")
-                    return {"error": f"Error applying {widget.name}"}
-
-            elif widget.name == "Uppercase Name Converter":
-                try:
-                    print("Converting names to uppercase")
-                    before_conversion = df[['first name', 'last name']].copy()  # Keep track of names before change
-                    df['first name'] = df['first name'].str.upper()
-                    df['last name'] = df['last name'].str.upper()
-                    print(f"Names before conversion:\n{before_conversion.head()}")
-                    print(f"Names after conversion:\n{df[['first name', 'last name']].head()}")
-                except Exception as e:
-                    print(f"Error applying Uppercase Name Converter: {e}")
-                    return {"error": f"Error applying {widget.name}"}
-
-            elif widget.name == "Date Filter":
-                try:
-                    start_date = "2024-09-01"  # Define start date (hardcoded for now, can be passed dynamically)
-                    end_date = "2024-10-12"  # Define end date (hardcoded for now, can be passed dynamically)
-                    print(f"Filtering rows between {start_date} and {end_date}")
-                    df['date'] = pd.to_datetime(df['date'], errors='coerce')
-                    before_filtering = df.copy()  # Keep track of DataFrame before filtering
-                    df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
-                    print(f"DataFrame before filtering:\n{before_filtering.head()}")
-                    print(f"DataFrame after filtering:\n{df.head()}")
-                except Exception as e:
-                    print(f"Error applying Date Filter: {e}")
-                    return {"error": f"Error applying {widget.name}"}
-
-            elif widget.name == "Row Deduplicator":
-                try:
-                    print("Removing duplicate rows based on 'customer id'")
-                    before_deduplication = df.copy()  # Keep track of DataFrame before deduplication
-                    
-                    # Drop duplicates based only on the 'customer id' column
-                    df = df.drop_duplicates(subset=['customer id'])
-                    
-                    print(f"DataFrame before deduplication:\n{before_deduplication.head()}")
-                    print(f"DataFrame after deduplication:\n{df.head()}")
-                    
-                    # Debugging for ensuring rows were dropped
-                    if df.equals(before_deduplication):
-                        print("No duplicate rows were removed based on 'customer id'.")
-                    else:
-                        print("Duplicates removed successfully based on 'customer id'.")
-                except Exception as e:
-                    print(f"Error applying Row Deduplicator: {e}")
-                    return {"error": f"Error applying {widget.name}"}
-
-            elif widget.code:
-                try:
-                    print(f"Widget code for {widget.name}:\n{widget.code}")
-                    df = execute_generated_code(widget.code, df)
-                    print(f"DataFrame after applying {widget.name}:\n", df.head())
-
-                    if df is None:
-                        print(f"Error: DataFrame is None after applying {widget.name}")
-                        return {"error": f"Widget {widget.name} failed to modify the CSV correctly."}
-
-                except Exception as e:
-                    print(f"Error applying widget {widget.name}: {e}")
-                    return {"error": f"Error applying widget {widget.name}"}
-
-        # Ensure all timestamp columns are converted to strings before returning preview data
-        if df is not None:
-            for col in df.columns:
-                print(f"Checking column {col} for datetime type")
-                if isinstance(df[col].dtype, pd.core.dtypes.dtypes.DatetimeTZDtype) or np.issubdtype(df[col].dtype, np.datetime64):
-                    print(f"Converting datetime column {col} to string")
-                    df[col] = df[col].dt.strftime('%Y-%m-%d')
-
-        print("Final modified DataFrame for preview:\n", df.head())  # Debugging: Show the final state of the DataFrame
-
-        # Convert DataFrame to JSON-serializable format
-        report_data = df.to_dict(orient='records')
-
-    return report_data
-
-
-
-
-
-
-
-
-
-
-def predict_future_sales(df):
-    # Ensure the date column is properly formatted
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')  # Coerce errors will turn bad dates into NaT (Not a Time)
-    
-    # Remove rows where date parsing failed
-    df = df.dropna(subset=['date'])
-    
-    if df.empty:
-        return {"error": "No valid dates found in the CSV."}
+        logger.debug('New report %s created.', report.pk)
+    return report
+
+
+def iter_report_chunks(plan, csv_file_path, chunksize=None, stats=None):
+    """
+    Yield the transformed CSV as a sequence of DataFrames.
+
+    Row-local plans are applied chunk by chunk, so only one chunk of the file
+    is in memory at a time. Other plans need the whole file and are run on it
+    in one go. Step stats are appended to `stats` once per chunk, see
+    combine_step_stats().
+    """
+    if plan.row_local:
+        columnar = open_sidecar(get_csv_path(csv_file_path))
+        if columnar is not None:
+            chunks = columnar.iter_chunks(chunksize or settings.REPORTS_CHUNK_ROWS, **plan_read_options(plan, columnar))
+        else:
+            columns = plan.required_columns(read_report_columns(csv_file_path))
+            chunks = read_report_csv_chunks(csv_file_path, chunksize, columns)
+        for chunk in chunks:
+            yield plan.run(chunk, stats=stats)
+    else:
+        yield from iter_frame_chunks(plan.run(read_plan_input(plan, csv_file_path), stats=stats), chunksize)
+
+
+def iter_frame_chunks(df, chunksize=None):
+    chunksize = chunksize or settings.REPORTS_CHUNK_ROWS
+    for start in range(0, max(len(df), 1), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def iter_csv_bytes(chunks, encoding='utf-8'):
+    """Encode a sequence of DataFrames as one CSV document, one piece per chunk."""
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode(encoding)
+        header = False
+
+
+def gzip_stream(pieces, level=6):
+    """Compress a stream of byte strings on the fly into a single gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def is_incremental(report, plan):
+    """Whether `report` is refreshed from the rows appended to its CSV, see AppendStore."""
+    if report is None or not report.incremental:
+        return False
+    if not plan.append_safe:
+        logger.info("Report %s is incremental but has widgets that need the whole CSV, processing all of it", report.pk)
+        return False
+    return True
+
+
+def materialize_report(user, widget_ids, csv_file_path, report, on_step=None, stats=None):
+    """
+    Generate a report and keep the resulting CSV in the artifact store, so the
+    next download streams it from disk. `on_step(index, df)` reports progress
+    and per-widget stats are appended to `stats`. Incremental reports only
+    process the rows appended since their last run, into the append store.
+    Row-local plans stream the CSV through the plan a chunk at a time, so
+    their memory use is bounded by REPORTS_CHUNK_ROWS; other plans resume
+    from the checkpoints of earlier runs.
+    """
+    ordered_widgets = get_ordered_widgets(widget_ids)
+
+    if csv_file_path and ordered_widgets:
+        plan = compile_plan(ordered_widgets)
+        csv_file_path = get_csv_path(csv_file_path)
+        if is_incremental(report, plan):
+            append_store.refresh(report.pk, plan, csv_file_path, on_step=on_step, stats=stats)
+            return save_report_data(user, ordered_widgets, report)
+
+        key = artifact_store.make_key(file_fingerprint(csv_file_path), plan.signatures())
+        if not artifact_store.exists(key):
+            if plan.row_local:
+                chunk_stats = []
+                chunks = iter_report_chunks(plan, csv_file_path, stats=chunk_stats)
+            else:
+                chunks = iter_frame_chunks(run_plan_checkpointed(plan, csv_file_path, on_step=on_step, stats=stats))
+            for _ in artifact_store.write_through(key, iter_csv_bytes(chunks)):
+                pass
+            if plan.row_local:
+                if stats is not None:
+                    stats.extend(combine_step_stats(chunk_stats, len(plan)))
+                if on_step is not None:
+                    on_step(len(plan) - 1, None)  # Every step ran on every chunk
+
+    return save_report_data(user, ordered_widgets, report)
+
+
+def run_preview_plan(plan, csv_file_path):
+    """Run a plan over the whole CSV, resuming from and filling the preview prefix cache."""
+    signatures = plan.signatures()
+    fingerprint = file_fingerprint(get_csv_path(csv_file_path))
+
+    # Resume from the longest prefix of this chain that was already computed
+    start, df = preview_cache.longest_prefix(fingerprint, signatures)
+    if df is None:
+        df = read_report_csv(csv_file_path)
+        preview_cache.put(preview_cache.make_key(fingerprint, ()), df)
+    logger.debug("Resuming preview after %s cached step(s)", start)
+
+    def cache_step(index, step_df):
+        preview_cache.put(preview_cache.make_key(fingerprint, signatures[:index + 1]), step_df)
+
+    return plan.run(df, start=start, on_step=cache_step)
+
+
+def head_rows(chunks, offset, limit):
+    """Return rows [offset, offset + limit) of a stream of DataFrames, reading no further than needed."""
+    pieces, seen, chunk = [], 0, None
+    for chunk in chunks:
+        if offset - seen < len(chunk):
+            pieces.append(chunk.iloc[max(offset - seen, 0):offset + limit - seen])
+        seen += len(chunk)
+        if seen >= offset + limit:
+            break
+    if pieces:
+        return pd.concat(pieces)
+    return chunk.iloc[0:0] if chunk is not None else pd.DataFrame()
+
+
+def reservoir_sample(chunks, size, seed=None):
+    """
+    Uniformly sample `size` rows from a stream of DataFrames while holding at
+    most one chunk plus the sample in memory. Every row gets a random key and
+    the rows with the smallest keys are kept; the sample stays in input order.
+    Returns (sample, total_rows).
+    """
+    rng = np.random.default_rng(seed)
+    sample, keys, total = None, None, 0
+    for chunk in chunks:
+        total += len(chunk)
+        chunk_keys = rng.random(len(chunk))
+        if sample is None:
+            sample, keys = chunk, chunk_keys
+        else:
+            sample, keys = pd.concat([sample, chunk]), np.concatenate([keys, chunk_keys])
+        if len(sample) > size:
+            keep = np.sort(np.argpartition(keys, size)[:size])
+            sample, keys = sample.iloc[keep], keys[keep]
+    return (sample if sample is not None else pd.DataFrame()), total
 
-    df = df.sort_values('date')  # Ensure data is sorted by date
 
-    # Prepare data for the regression model
-    df['date_ordinal'] = df['date'].map(pd.Timestamp.toordinal)  # Convert date to ordinal for regression
-    X = df['date_ordinal'].values.reshape(-1, 1)
-    y = df['value'].values
+def frame_to_records(df):
+    # Ensure all timestamp columns are converted to strings before returning preview data
+    datetime_columns = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col].dtype)]
+    df = df.assign(**{col: df[col].dt.strftime('%Y-%m-%d') for col in datetime_columns})
+    df = plain_dtypes(df)  # Missing values of string columns are pd.NA, which isn't JSON serializable
 
-    # Train a simple linear regression model
-    model = LinearRegression()
-    model.fit(X, y)
+    # Convert DataFrame to JSON-serializable format
+    return df.to_dict(orient='records')
 
-    # Predict the next 30 days
-    future_dates = pd.date_range(df['date'].max() + pd.Timedelta(days=1), periods=30).to_pydatetime()
-    future_dates_ordinal = [pd.Timestamp(date).toordinal() for date in future_dates]
-    future_predictions = model.predict([[d] for d in future_dates_ordinal])
 
-    # Combine future dates and predictions into a dictionary
-    future_sales = {str(date.date()): round(prediction, 2) for date, prediction in zip(future_dates, future_predictions)}
+def generate_report_preview_page(widget_ids, csv_file_path, limit=None, offset=0, sample='head', seed=None):
+    """
+    Preview the CSV after applying `widget_ids`, returning up to `limit` rows
+    starting at `offset` (sample='head') or a uniform random sample of `limit`
+    rows (sample='reservoir'). Row-local chains only read as much of the file
+    as the page needs unless the full result is already cached.
+
+    Returns {'rows': DataFrame, 'total_rows': int or None} or {'error': message}.
+    """
+    logger.debug("Preview of %s with widgets %s", csv_file_path, widget_ids)
+    return preview_plan_page(compile_plan(get_ordered_widgets(widget_ids)), csv_file_path, limit, offset, sample, seed)
 
-    return future_sales
+
+def preview_plan_page(plan, csv_file_path, limit=None, offset=0, sample='head', seed=None):
+    # generate_report_preview_page() for an already compiled plan, without touching the database
+    try:
+        fingerprint = file_fingerprint(get_csv_path(csv_file_path))
+        cached = preview_cache.get(preview_cache.make_key(fingerprint, plan.signatures()))
+
+        if limit is not None and cached is None and plan.row_local:
+            # Stream the file through the chain and stop once the page is filled
+            chunksize = min(settings.REPORTS_CHUNK_ROWS, max(offset + limit, 1000))
+            chunks = iter_report_chunks(plan, csv_file_path, chunksize)
+            if sample == 'reservoir':
+                rows, total_rows = reservoir_sample(chunks, limit, seed)
+            else:
+                rows, total_rows = head_rows(chunks, offset, limit), None
+        else:
+            df = cached if cached is not None else run_preview_plan(plan, csv_file_path)
+            total_rows = len(df)
+            if limit is None:
+                rows = df.iloc[offset:]
+            elif sample == 'reservoir':
+                rows, _ = reservoir_sample([df], limit, seed)
+            else:
+                rows = df.iloc[offset:offset + limit]
+    except OperatorError as e:
+        logger.warning("Error applying widget %s: %s", e.widget_name, e.__cause__ or e)
+        return {"error": str(e)}
+    except Exception as e:
+        logger.warning("Error loading CSV file %s: %s", csv_file_path, e)
+        return {"error": "Error loading CSV"}
+
+    return {'rows': rows, 'total_rows': total_rows}
+
+
+def predict_future_sales(df, horizon=30):
+    # Linear trend over the whole frame, see forecast.py for forecasting many series at once
+    keys, dates, predictions = forecast_series(df, horizon=horizon)
+    if not len(keys):
+        return {"error": "No valid dates found in the CSV."}
+
+    # Combine future dates and predictions into a dictionary
+    return {str(date): round(float(prediction), 2) for date, prediction in zip(dates[0], predictions[0])}
 
 
 
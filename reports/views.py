@@ -1,19 +1,34 @@
+import logging
 import os
-import pandas as pd
 from django.conf import settings
-from django.core.files.storage import FileSystemStorage
-from django.db import models
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponseRedirect, JsonResponse, HttpResponse
+from django.http import (
+    HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse, HttpResponse, HttpResponseNotModified,
+    StreamingHttpResponse,
+)
 from django.urls import reverse
+from django.utils.http import parse_etags
 from django.views.generic.edit import UpdateView, DeleteView
 from .models import Report
 from .forms import ReportForm
-from .utils import generate_report, generate_report_preview
+from .appends import append_store
+from .artifacts import artifact_store
+from .cache import file_fingerprint
+from .catalog import widget_catalog
+from .encoders import encode_preview_response
+from .operators import compile_plan
+from .jobs import enqueue_report_generation, recover_jobs
+from .storage import upload_storage
+from .utils import (
+    frame_to_records, generate_report_preview_page, get_csv_path,
+    get_ordered_widgets, gzip_stream, is_incremental, iter_csv_bytes, iter_report_chunks,
+)
 from widgets.models import Widget
 from widgets.views import PRELOADED_WIDGET_IDS
 
 
+logger = logging.getLogger(__name__)
+
 def report_list(request):
     reports = Report.objects.filter(user=request.user)
     return render(request, 'reports/report_list.html', {'reports': reports})
@@ -32,80 +47,146 @@ def report_detail(request, report_id):
         'report': report, 
         'information': report.information,
         'data': report.data,  # Pass the report data to the template
-        'last_widget_id': last_widget_id  # Pass the last widget ID for CSV download
+        'last_widget_id': last_widget_id,  # Pass the last widget ID for CSV download
+        'job': report.jobs.first(),  # Latest generation job, polled while it runs
     })
 
+
+def report_status(request, report_id):
+    report = get_object_or_404(Report, id=report_id)
+    job = report.jobs.first()
+    if job is not None and job.is_active:
+        # Picks the job up again if the process running it was restarted
+        recover_jobs()
+        job.refresh_from_db()
+    return JsonResponse(job_status(job))
+
+
+def regenerate_report(request, report_id):
+    # Re-run the report's widgets over its CSV in the background, the report page polls the job
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    report = get_object_or_404(Report, id=report_id)
+    job = enqueue_report_generation(report, request.user, report.widgets.values_list('id', flat=True))
+    job.refresh_from_db()
+    return JsonResponse(job_status(job), status=202)
+
+
+def job_status(job):
+    if job is None:
+        return {'status': None}
+    return {
+        'job': job.pk,
+        'status': job.status,
+        'progress': job.progress,
+        'steps_done': job.steps_done,
+        'total_steps': job.total_steps,
+        'error': job.error if job.status == job.FAILED else '',
+    }
+
 def create_report_view(request):
     if request.method == 'POST':
         form = ReportForm(request.POST, request.FILES)
 
         # Check if form is valid
         if form.is_valid():
-            print('Form is valid')
 
             title = form.cleaned_data['title']
             widgets = form.cleaned_data['widgets']  # Get the selected widgets
-            print(f'Selected widgets: {widgets}')
+            logger.debug('Selected widgets: %s', widgets)
             
             information = form.cleaned_data['information']
-            print(f'Report information: {information}')
+            logger.debug('Report information: %s', information)
 
             # Handle CSV file upload
             csv_file = request.FILES.get('csv_file', None)
             csv_file_path = None
-            if csv_file:
-                print('CSV file detected, saving...')
-                fs = FileSystemStorage()
-                csv_file_path = fs.save(csv_file.name, csv_file)
-                csv_file_path = fs.path(csv_file_path)
-                print(f'CSV file saved at: {csv_file_path}')
-            else:
-                print('No CSV file uploaded')
-
-            # Create the report object first
-            report = Report.objects.create(
-                user=request.user,
-                title=title,
-                information=information,
-                csv_file=csv_file_path
-            )
+            # The stored CSV can't be released before the report referencing it exists
+            with upload_storage.lock():
+                if csv_file:
+                    csv_file_path = upload_storage.save_upload(csv_file)
+                    logger.debug('CSV file saved at: %s', csv_file_path)
+                else:
+                    logger.debug('No CSV file uploaded')
+
+                # Create the report object first
+                report = Report.objects.create(
+                    user=request.user,
+                    title=title,
+                    information=information,
+                    csv_file=csv_file_path,
+                    incremental=form.cleaned_data['incremental'],
+                )
             
             # Set the selected widgets for the report
             report.widgets.set(widgets)
 
-            # Generate the report (now treating the returned value as the DataFrame)
-            final_df = generate_report(
-                user=request.user,
-                widget_ids=widgets.values_list('id', flat=True),
-                csv_file_path=csv_file_path,
-                report=report
-            )
-
-            # Save the report object again after generating the data
-            report.save()
-            print(f'Report saved with widgets: {widgets}')
+            # Generate the report in the background, the report page polls its progress
+            enqueue_report_generation(report, request.user, widgets.values_list('id', flat=True))
+            logger.debug('Report saved with widgets: %s', widgets)
 
             return redirect('report_detail', report_id=report.pk)
         else:
-            print(f'Form is invalid: {form.errors}')  # Print form errors for easier debugging
+            logger.info('Form is invalid: %s', form.errors)
     else:
         form = ReportForm()
 
     return render(request, 'reports/create_report.html', {'form': form})
 
 
+def parse_preview_request(request):
+    """Return the widget ids and paging options of a preview request, raising ValueError when they are invalid."""
+    widget_ids_str = request.POST.get('widgets', '')
+    widget_ids = [int(widget_id) for widget_id in widget_ids_str.split(',') if widget_id.isdigit()]
+
+    # Optional paging: `limit` rows from `offset`, or a random sample of `limit` rows
+    try:
+        limit = int(request.POST['limit']) if request.POST.get('limit') else None
+        offset = int(request.POST.get('offset') or 0)
+    except ValueError:
+        raise ValueError("limit and offset must be integers.")
+    sample = request.POST.get('sample', 'head')
+    # 'records' is a list of row objects, 'columnar' is {"columns": [...], "data": [[column values], ...]}
+    preview_format = request.POST.get('format', 'records')
+    if (sample not in ('head', 'reservoir') or preview_format not in ('records', 'columnar')
+            or offset < 0 or (limit is not None and limit < 0)):
+        raise ValueError("Invalid preview parameters.")
+    return widget_ids, {'limit': limit, 'offset': offset, 'sample': sample, 'format': preview_format}
+
+
+def preview_response(page, options):
+    if 'error' in page:
+        return JsonResponse({'preview': page})
+
+    meta = {
+        'total_rows': page['total_rows'],
+        'offset': options['offset'],
+        'limit': options['limit'],
+        'sample': options['sample'],
+        'format': options['format'],
+    }
+    if options['format'] == 'columnar':
+        return HttpResponse(encode_preview_response(page['rows'], **meta), content_type='application/json')
+    return JsonResponse({'preview': frame_to_records(page['rows']), **meta})
+
+
 def preview_csv(request, report_id):
     if request.method == 'POST':
-        widget_ids_str = request.POST.get('widgets', '')
-        widget_ids = [int(widget_id) for widget_id in widget_ids_str.split(',') if widget_id.isdigit()]
+        try:
+            widget_ids, options = parse_preview_request(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
 
         report = get_object_or_404(Report, id=report_id)
         csv_file_path = report.csv_file
+        if not csv_file_path:
+            return JsonResponse({'preview': {}})
 
         # Generate a preview of the report data up to the selected widgets
-        preview_data = generate_report_preview(widget_ids, csv_file_path)
-        
-        return JsonResponse({'preview': preview_data})
+        page = generate_report_preview_page(
+            widget_ids, csv_file_path, options['limit'], options['offset'], options['sample']
+        )
+        return preview_response(page, options)
 
 def edit_report(request, report_id):
     report = get_object_or_404(Report, id=report_id)
@@ -116,23 +197,20 @@ def edit_report(request, report_id):
         widget_ids_str = request.POST.get('widgets', '')  # Fetch widgets from form (default to empty string if not found)
         widget_ids = [int(widget_id) for widget_id in widget_ids_str.split(',') if widget_id.isdigit()]  # Convert to integers
 
-        print("Widget IDs after splitting:", widget_ids)  # Debug: Check if widget IDs are correctly split and converted
+        logger.debug("Widget IDs after splitting: %s", widget_ids)
 
-        # Step 2: Create a QuerySet of widgets and preserve the order based on widget IDs
-        widgets_qs = Widget.objects.filter(id__in=widget_ids).order_by(
-            models.Case(
-                *[models.When(id=widget_id, then=pos) for pos, widget_id in enumerate(widget_ids)],
-                output_field=models.IntegerField(),
-            )
-        )
-        print("Ordered widgets in queryset:", widgets_qs)  # Debug: Verify the order of widgets
+        # Step 2: Fetch the widgets in one query and keep the order of the widget IDs, skipping unknown ones
+        widgets_by_id = widget_catalog.get_many(widget_ids)
+        widget_ids = [widget_id for widget_id in widget_ids if widget_id in widgets_by_id]
+        ordered_widgets = [widgets_by_id[widget_id] for widget_id in widget_ids]
+        logger.debug("Ordered widgets: %s", ordered_widgets)
 
         # Update the request.POST to pass the actual widget objects to the form
         form = ReportForm(instance=report, data=request.POST)
         form.data = form.data.copy()  # Make the form data mutable
 
         # Provide the correct widget instances to the form's 'widgets' field
-        form.data.setlist('widgets', [str(widget.id) for widget in widgets_qs])
+        form.data.setlist('widgets', [str(widget.id) for widget in ordered_widgets])
 
         if form.is_valid():
             # Save the report information first
@@ -140,37 +218,32 @@ def edit_report(request, report_id):
             report.information = form.cleaned_data['information']
 
             # Save widgets to the report
-            report.widgets.set(widgets_qs)  # Set the widget queryset
+            report.widgets.set(ordered_widgets)
 
             # Step 3: Ensure widget data and order are stored in the `data` field of the report
             widget_data = {}
-            for widget_id in widget_ids:  # Iterate over the widget_ids in the correct order
-                widget = widgets_qs.get(id=widget_id)  # Ensure we're fetching the widget by the correct order
+            for widget in ordered_widgets:  # In the order of the widget_ids
                 widget_data[widget.name] = widget.description
 
             report.data = widget_data  # Store the widget data in the report's data field
             report.save()  # Ensure the report is saved after updating the `data` field
 
-            print("Widget data being saved to report's data field:", report.data)  # Debug: Ensure the data is being updated
+            logger.debug("Widget data being saved to report's data field: %s", report.data)
 
             # Handle CSV upload if any
             csv_file = request.FILES.get('csv_file', None)
-            if csv_file:
-                fs = FileSystemStorage()
-                csv_file_path = fs.save(csv_file.name, csv_file)
-                report.csv_file = fs.path(csv_file_path)
-
-            # Re-generate report data based on widgets and csv_file
-            generate_report(
-                user=request.user,
-                widget_ids=widget_ids,  # Pass the split widget IDs
-                csv_file_path=report.csv_file,
-                report=report
-            )
+            with upload_storage.lock():
+                if csv_file:
+                    report.csv_file = upload_storage.save_upload(csv_file)
+
+                report.save()
+
+            # Re-generate report data based on widgets and csv_file in the background
+            enqueue_report_generation(report, request.user, widget_ids)
 
             return redirect('report_detail', report_id=report.id)
         else:
-            print("Form errors:", form.errors)  # Add this line to show form errors in the console
+            logger.info("Form errors: %s", form.errors)
 
     current_csv = report.csv_file if report.csv_file else "No CSV uploaded yet"
     widgets = Widget.objects.all()
@@ -184,7 +257,7 @@ def edit_report(request, report_id):
         # Handle missing widgets in widget_order gracefully
         selected_widgets = sorted(selected_widgets, key=lambda w: widget_order.index(w.name) if w.name in widget_order else -1)
     else:
-        print("Warning: report.data is not a dictionary. It is of type:", type(report.data))
+        logger.warning("report.data is not a dictionary. It is of type: %s", type(report.data))
         selected_widgets = list(selected_widgets)  # Just convert to a list without reordering
 
     return render(request, 'reports/edit_report.html', {
@@ -211,37 +284,86 @@ def delete_report(request, report_id):
 def upload_csv(request):
     if request.method == 'POST' and request.FILES['csv_file']:
         csv_file = request.FILES['csv_file']
-        fs = FileSystemStorage()
-        file_path = fs.save(csv_file.name, csv_file)
-        file_url = fs.url(file_path)
-
-        # Use pandas to read the CSV file
-        df = pd.read_csv(fs.path(file_path))
-        # Example: Show the first few rows in the template
-        data = df.head().to_html()
 
-        return render(request, 'reports/upload_csv.html', {'data': data})
+        # Show what CSVUploadHandler gathered while receiving the file instead of parsing it again.
+        # The file belongs to no report, so it isn't stored: its temporary copy goes with the request.
+        profile = getattr(csv_file, 'profile', None)
+        return render(request, 'reports/upload_csv.html', {'profile': profile, 'file_name': csv_file.name})
 
     return render(request, 'reports/upload_csv.html')
 
+def report_download_key(report, plan):
+    """
+    Return (artifact key, append store state) for downloading `report`, or
+    (None, None) when there is nothing to export. Hashes or catches up with
+    the CSV, so it is slow for large files.
+    """
+    csv_file_path = get_csv_path(report.csv_file)
+    if is_incremental(report, plan):
+        # Catch up with the rows appended since the last run, then serve the stored result
+        state = append_store.refresh(report.pk, plan, csv_file_path)
+        if state is None:
+            return None, None
+        return artifact_store.make_key(state['prefix_sha256'], plan.signatures()), state
+    return artifact_store.make_key(file_fingerprint(csv_file_path), plan.signatures()), None
+
+
+def download_etag(request, key):
+    compress = request.GET.get('compress') == 'gzip'
+    return f'"{key}-gzip"' if compress else f'"{key}"'
+
+
+def not_modified(request, etag):
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    return None
+
+
+def report_download_content(request, report, plan, key, state):
+    """Return (byte pieces, filename, content type) of a download, generating the CSV as it is read if needed."""
+    # Serve the stored artifact, or generate it while streaming it to the client
+    if state is not None:
+        content = append_store.read(report.pk, plan, state)
+    else:
+        content = artifact_store.read(key)
+    if content is None:
+        csv_file_path = get_csv_path(report.csv_file)
+        content = artifact_store.write_through(key, iter_csv_bytes(iter_report_chunks(plan, csv_file_path)))
+
+    filename = f"{report.title}.csv"
+    content_type = 'text/csv'
+    if request.GET.get('compress') == 'gzip':
+        content = gzip_stream(content)
+        filename += '.gz'
+        content_type = 'application/gzip'
+    return content, filename, content_type
+
+
+def streaming_download(content, filename, content_type, etag):
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['ETag'] = etag
+    return response
+
+
 def download_csv_report(request, report_id):
     report = get_object_or_404(Report, id=report_id)
 
-    # Generate the report to get the final modified DataFrame
-    final_df = generate_report(
-        user=request.user,
-        widget_ids=report.widgets.values_list('id', flat=True),
-        csv_file_path=report.csv_file,
-        report=report
-    )
+    ordered_widgets = get_ordered_widgets(report.widgets.values_list('id', flat=True))
+    if not report.csv_file or not ordered_widgets:
+        return HttpResponse("No data to export.", status=404)
 
-    if final_df is not None:
-        # Convert the final DataFrame to a CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{report.title}.csv"'
+    plan = compile_plan(ordered_widgets)
+    key, state = report_download_key(report, plan)
+    if key is None:
+        return HttpResponse("No data to export.", status=404)
 
-        final_df.to_csv(path_or_buf=response, index=False)  # Save the final DataFrame as CSV to the response
+    etag = download_etag(request, key)
+    response = not_modified(request, etag)
+    if response is not None:
         return response
-    else:
-        return HttpResponse("No data to export.", status=404)
 
+    content, filename, content_type = report_download_content(request, report, plan, key, state)
+    return streaming_download(content, filename, content_type, etag)
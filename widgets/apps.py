@@ -10,6 +10,12 @@ class WidgetsConfig(AppConfig):
         # Connect post_migrate signal
         post_migrate.connect(create_default_widgets, sender=self)
 
+        # Optionally start loading the code generation model with the worker
+        from django.conf import settings
+        if settings.WIDGET_CODEGEN_WARMUP:
+            from nimbus.utils import warm_up_generator
+            warm_up_generator()
+
 
 def create_default_widgets(sender, **kwargs):
     from django.apps import apps
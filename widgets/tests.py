@@ -1,3 +1,81 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from nimbus import utils as codegen
+
+
+class FakeGenerator:
+    # Records the prompts of each call and answers every prompt with its uppercased text
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, prompts, max_length=200, num_return_sequences=1, **kwargs):
+        self.calls.append(list(prompts))
+        if self.error is not None:
+            raise self.error
+        return [[{'generated_text': prompt.upper()}] for prompt in prompts]
+
+
+class GenerationBatcherTests(SimpleTestCase):
+    def generate_concurrently(self, batcher, prompts):
+        with ThreadPoolExecutor(len(prompts)) as executor:
+            futures = [executor.submit(batcher.generate, prompt) for prompt in prompts]
+        return [future.exception() or future.result() for future in futures]
+
+    def test_concurrent_prompts_share_one_batch(self):
+        generator = FakeGenerator()
+        # A batch closes as soon as it is full, so the long wait is never reached
+        batcher = codegen.GenerationBatcher(max_batch_size=4, max_wait=10)
+        with mock.patch.object(codegen, 'get_generator', return_value=generator):
+            results = self.generate_concurrently(batcher, ['a', 'b', 'c', 'd'])
+        self.assertEqual(results, ['A', 'B', 'C', 'D'])
+        self.assertEqual(len(generator.calls), 1)
+        self.assertCountEqual(generator.calls[0], ['a', 'b', 'c', 'd'])
+
+    def test_batch_closes_after_max_wait(self):
+        generator = FakeGenerator()
+        batcher = codegen.GenerationBatcher(max_batch_size=8, max_wait=0.01)
+        with mock.patch.object(codegen, 'get_generator', return_value=generator):
+            self.assertEqual(batcher.generate('a'), 'A')
+            self.assertEqual(batcher.generate('b'), 'B')
+        self.assertEqual(generator.calls, [['a'], ['b']])
+
+    def test_errors_reach_every_prompt_of_the_batch(self):
+        generator = FakeGenerator(error=RuntimeError('out of memory'))
+        batcher = codegen.GenerationBatcher(max_batch_size=2, max_wait=10)
+        with mock.patch.object(codegen, 'get_generator', return_value=generator):
+            results = self.generate_concurrently(batcher, ['a', 'b'])
+            self.assertEqual([str(result) for result in results], ['out of memory'] * 2)
+
+            # The worker keeps serving later prompts
+            generator.error = None
+            self.assertEqual(self.generate_concurrently(batcher, ['c', 'd']), ['C', 'D'])
+
+
+class GeneratorTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(codegen, '_generator', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_model_is_loaded_once_per_process(self):
+        loaded = threading.Event()
+        with mock.patch.object(codegen, '_load_generator', side_effect=lambda: loaded.wait(1) or FakeGenerator()) as load:
+            threads = [threading.Thread(target=codegen.get_generator) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            loaded.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(load.call_count, 1)
+
+    @override_settings(WIDGET_CODEGEN_BACKEND='stub')
+    def test_stub_backend_returns_a_widget(self):
+        code = codegen.generate_widget_from_text('drop empty rows')
+        self.assertIn('drop empty rows', code)
+        self.assertIn('def transform(df):', code)